@@ -30,6 +30,11 @@ import keyboard
 # File containing intent definitions and a built IntentionCollection
 import voice_intents
 
+from pyretree.dispatch import Dispatcher
+
+# Runs intent callbacks (which may launch programs) without holding up recognition
+dispatcher = Dispatcher(voice_intents.intentions, max_workers=2)
+
 
 # Audio recording parameters
 RATE = 16000
@@ -156,9 +161,8 @@ def recognize_intent_loop(responses):
             continue
         
         text = result.alternatives[0].transcript.lstrip()  # Won't know if it's a continuation!
-        result = voice_intents.intentions.match(text)
         
-        if not result:
+        if dispatcher.dispatch(text) is None:
             print(f'Sorry, I don\'t know how to help with "{text}"')
             
 
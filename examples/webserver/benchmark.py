@@ -0,0 +1,97 @@
+import argparse
+import http.client
+import socket
+import threading
+import time
+
+from webserver import AsyncWebServer, PooledWebServer, ThreadedWebServer, build_json_response
+
+
+# --------
+def _client(host, port, requests, keep_alive, failures):
+    # Keep-alive clients reuse one connection; the others open a new one per request, as the server used to require
+    connection = None
+
+    for _ in range(requests):
+        if connection is None:
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+
+        try:
+            connection.request('GET', '/bench/item?id=1', headers={} if keep_alive else {'Connection': 'close'})
+            response = connection.getresponse()
+            response.read()
+
+            if response.status != 200:
+                failures.append(response.status)
+
+        except (OSError, http.client.HTTPException) as ex:
+            failures.append(ex)
+            connection.close()
+            connection = None
+            continue
+
+        if not keep_alive:
+            connection.close()
+            connection = None
+
+    if connection is not None:
+        connection.close()
+
+# ----
+def run(host, port, clients, requests, keep_alive):
+    """
+    Returns (tuple): (float) requests per second, (int) failed requests
+    """
+
+    failures = []
+    threads = [threading.Thread(target=_client, args=(host, port, requests, keep_alive, failures)) for _ in range(clients)]
+
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+
+    return clients * requests / elapsed, len(failures)
+
+
+# --------
+_SERVERS = {'threaded': ThreadedWebServer, 'pooled': PooledWebServer, 'asyncio': AsyncWebServer}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the example webservers with and without persistent connections.')
+    parser.add_argument('--server', choices=[*_SERVERS, 'all'], default='all', help='Server to measure')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=500, help='Requests sent by each client')
+    parser.add_argument('--idle', type=int, default=0, help='Idle keep-alive connections held open while measuring')
+    args = parser.parse_args()
+
+    for server_name in (_SERVERS if args.server == 'all' else [args.server]):
+        server = _SERVERS[server_name]('localhost', 0, idle_timeout=5)
+
+        @server.add_path('GET:/bench/<name>')
+        def bench(name, url_params):
+            return build_json_response({'name': name, 'id': url_params.get('id')})
+
+        server.start()
+        idle_connections = [socket.create_connection(('localhost', server.port)) for _ in range(args.idle)]
+
+        try:
+            for label, keep_alive in (('Connection: close', False), ('keep-alive', True)):
+                throughput, failed = run('localhost', server.port, args.clients, args.requests, keep_alive)
+                print(f'{server_name:>8} {label:>17}: {throughput:8.0f} requests/second ({failed} failed)')
+
+            if isinstance(server, PooledWebServer):
+                stats = server.stats()
+                print(f'{"":>8} {stats["accepted"]} connections queued, {stats["rejected"]} rejected, '
+                      f'waited {stats["wait_avg"] * 1e3:.2f}ms on average and {stats["wait_max"] * 1e3:.2f}ms at most')
+
+        finally:
+            for connection in idle_connections:
+                connection.close()
+
+            server.shutdown()
@@ -1,6 +1,8 @@
+import asyncio
 import pathlib
+import sys
 
-from webserver import ThreadedWebServer, build_http_response, build_file_response, build_html_response, build_json_response
+from webserver import AsyncWebServer, PooledWebServer, ThreadedWebServer, build_http_response, build_file_response, build_html_response, build_json_response
 
 
 # --------
@@ -9,12 +11,19 @@ ROOT = pathlib.Path(__file__).parent.absolute() / 'www-root'
 MEDIA_ROOT = ROOT / 'media'
 TEMPLATE_ROOT = ROOT / 'templates'
 
-server = ThreadedWebServer('localhost', 5000)
+# Run with --asyncio to serve every connection from one event loop instead of a thread per connection, or with
+# --pooled to serve them from a fixed number of threads
+if '--asyncio' in sys.argv:
+    server = AsyncWebServer('localhost', 5000)
+elif '--pooled' in sys.argv:
+    server = PooledWebServer('localhost', 5000)
+else:
+    server = ThreadedWebServer('localhost', 5000)
 
 # --------
 @server.add_path('GET:/')
-def root():
-    return build_file_response(TEMPLATE_ROOT / 'home.html')
+def root(headers):
+    return build_file_response(TEMPLATE_ROOT / 'home.html', headers=headers)
 
 # ----
 @server.add_path('GET:/hello_world')
@@ -34,13 +43,13 @@ def teapot():
 
 # ----
 @server.add_path('GET:/favicon.ico')
-def favicon():
-    return build_file_response(MEDIA_ROOT / 'favicon.png')
+def favicon(headers):
+    return build_file_response(MEDIA_ROOT / 'favicon.png', headers=headers)
 
 # ----
 @server.add_path('GET:/<filepath>')
-def files(filepath):
-    return build_file_response(ROOT / filepath)
+def files(filepath, headers):
+    return build_file_response(ROOT / filepath, headers=headers)
 
 # ----
 @server.add_path('GET:/api/hello')
@@ -59,6 +68,15 @@ def json_get_echo_endpoint(url_params=None):
 
     return build_json_response({'message': msg, 'opt': opt})
 
+# --
+@server.add_path('GET:/api/wait/<seconds>')
+async def json_wait_endpoint(seconds):
+    # Coroutine handlers wait without holding a thread on AsyncWebServer
+    seconds = min(float(seconds), 5)
+    await asyncio.sleep(seconds)
+
+    return build_json_response({'waited': seconds})
+
 # --
 @server.add_path('POST:/api/echo')
 def json_post_echo_endpoint(form_data=None):
@@ -0,0 +1,318 @@
+import pathlib
+import re
+import sys
+
+try:
+    from pyretree import pyretree
+    from pyretree.pyretree import helpers
+except ImportError:
+    # Gross way to import from the repository structure
+    sys.path.append(str(pathlib.Path(__file__).parent.parent.parent.parent.absolute()))
+    from pyretree import pyretree
+    from pyretree.pyretree import helpers
+
+
+_PARAM_RE = re.compile(r'<(\w+)>')
+_TYPED_PARAM_RE = re.compile(r'<(\w+):(\w+)>')
+
+# Typed parameters are tried narrowest first, as pyretree does for typed tree edges. Placeholder parsing is shared
+# with pyretree's internals so routes and expressions accept the same syntax
+_TYPE_ORDER = {type_name: type_pos for type_pos, type_name in enumerate(helpers._VARIABLE_TYPES)}
+
+
+class _RouteNode:
+    __slots__ = ('static', 'typed', 'patterns', 'param', 'catch_all', 'route')
+
+    def __init__(self):
+        self.static = {}     # segment -> _RouteNode
+        self.typed = {}      # type name -> (test, _RouteNode), narrowest type first
+        self.patterns = {}   # segment pattern -> (compiled regex, _RouteNode)
+        self.param = None    # _RouteNode reached by any non-empty segment
+        self.catch_all = None  # _Route taking the rest of the path
+        self.route = None    # _Route of paths ending at this node
+
+# ----
+class _Route:
+    __slots__ = ('expression', 'callback', 'names', 'converters', 'accepted')
+
+    def __init__(self, expression, callback, names):
+        """
+        expression (str) : The route as added
+        callback (callable) : The function bound to the route
+        names (list) : For each captured segment, the parameter it is passed as, or None if it is a pattern
+                       segment whose named groups are passed
+        """
+
+        self.expression = expression
+        self.callback = callback
+        self.names = names
+        self.converters = helpers._placeholder_converters(expression)
+        self.accepted = helpers._accepted_params(callback)
+
+    # ----
+    def bind(self, captures, extra_params):
+        """
+        Returns (RegexMatch | None): The call of the callback, or None if a typed value does not convert
+        """
+
+        kwargs = {}
+
+        for name, value in zip(self.names, captures):
+            if name is None:
+                kwargs.update(value)
+            else:
+                kwargs[name] = value
+
+        try:
+            for name, converter in self.converters.items():
+                if kwargs.get(name) is not None:
+                    kwargs[name] = converter(kwargs[name])
+
+        # Fits the pattern but not the type, such as 2021-02-30 for a date
+        except ValueError:
+            return None
+
+        # Look up only the extra parameters the callback accepts; the server computes their values on access
+        if self.accepted is None:
+            kwargs.update(extra_params)
+        else:
+            kwargs.update((name, extra_params[name]) for name in self.accepted if name in extra_params)
+
+        return pyretree.RegexMatch(self.callback, kwargs, self.expression)
+
+
+# --------
+class Router:
+
+    def __init__(self):
+        """
+        Routes "METHOD:/path" strings to path functions with one radix tree of path segments per HTTP method, so
+        finding the route of a request takes a dict lookup per segment instead of trying regexps. At each segment,
+        a static segment beats a typed parameter (<id:int>, narrowest type first), which beats a pattern segment
+        (<name>\.<ext>, <id=[0-9a-f]+>), which beats an untyped parameter (<name>), which beats a catch-all; when a
+        branch leads nowhere the next one is tried.
+
+        An untyped parameter in the last segment of a route (GET:/<filepath>) is a catch-all: it also takes
+        the slashes of the rest of the path. Other parameters take exactly one segment. Routes the tree cannot
+        hold (a pattern containing /, a path not starting with /) are kept in a pyretree RegexCollection that is
+        consulted when the tree has no other route than a catch-all.
+        """
+
+        self._trees = {}
+        self._fallback = None
+        self._prev_function = None
+
+        self.prepared = False
+
+    # ----
+    def add(self, expression):
+        """
+        Decorator : Add a route and bind it to the decorated function.
+        ----
+        expression (str) : A route in the format "HTTP_VERB:path"; for example, "GET:/blog/posts/<post_id>".
+        """
+
+        def route_adder(callback, *args, **kwargs):
+            # Cache previous function to resolve issue with stacked decorators
+            if callback is None:
+                callback = self._prev_function
+            self._prev_function = callback
+
+            self._add(expression, callback)
+
+            return callback
+
+        return route_adder
+
+    # ----
+    def _add(self, expression, callback):
+        method, _, path = expression.partition(':')
+
+        if not path.startswith('/') or any('/' in pattern for _, _, pattern in helpers._PLACEHOLDER_PARSER.findall(path)):
+            if self._fallback is None:
+                self._fallback = pyretree.RegexCollection(separator='/')
+
+            self._fallback.add(expression)(callback)
+            return
+
+        node = self._trees.setdefault(method, _RouteNode())
+        segments = path[1:].split('/')
+        names = []
+
+        for segment_pos, segment in enumerate(segments):
+            if '<' not in segment:
+                node = node.static.setdefault(segment, _RouteNode())
+                continue
+
+            param = _PARAM_RE.fullmatch(segment)
+
+            if param is not None and segment_pos == len(segments) - 1:
+                names.append(param.group(1))
+                self._set_route(node, 'catch_all', _Route(expression, callback, names))
+                return
+
+            if param is not None:
+                names.append(param.group(1))
+
+                if node.param is None:
+                    node.param = _RouteNode()
+
+                node = node.param
+                continue
+
+            typed = _TYPED_PARAM_RE.fullmatch(segment)
+
+            if typed is not None:
+                name, type_name = typed.groups()
+
+                if type_name not in helpers._VARIABLE_TYPES:
+                    raise Exception(f'Unknown variable type "{type_name}"; expected one of {", ".join(helpers._VARIABLE_TYPES)}')
+
+                names.append(name)
+
+                if type_name not in node.typed:
+                    node.typed[type_name] = (helpers._TYPED_EDGE_TESTS[f'<{type_name}>'], _RouteNode())
+                    node.typed = dict(sorted(node.typed.items(), key=lambda item: _TYPE_ORDER[item[0]]))
+
+                node = node.typed[type_name][1]
+                continue
+
+            # Anything else in a segment is compiled the way pyretree compiles whole expressions
+            names.append(None)
+
+            if segment not in node.patterns:
+                pattern = helpers._PLACEHOLDER_PARSER.sub(helpers._expand_placeholder, segment).replace('>)', '>.*?)')
+                node.patterns[segment] = (re.compile(pattern), _RouteNode())
+
+            node = node.patterns[segment][1]
+
+        self._set_route(node, 'route', _Route(expression, callback, names))
+
+    # ----
+    @staticmethod
+    def _set_route(node, slot, route):
+        existing = getattr(node, slot)
+
+        if existing is not None:
+            raise Exception(f'Route "{route.expression}" conflicts with "{existing.expression}"')
+
+        # Fail now rather than on the first request if the function cannot take what the route extracts
+        if route.accepted is not None:
+            names = {name.partition(':')[0] for name, _, _ in helpers._PLACEHOLDER_PARSER.findall(route.expression)}
+            missing = names - route.accepted
+
+            if missing:
+                raise Exception(f'{route.callback.__name__}() cannot accept {", ".join(sorted(missing))} of route "{route.expression}"')
+
+        setattr(node, slot, route)
+
+    # ----
+    def prepare(self):
+        """
+        Prepare the fallback RegexCollection; call once every route has been added.
+        """
+
+        if self._fallback is not None:
+            self._fallback.prepare()
+
+        self.prepared = True
+
+    # ----
+    def _find(self, node, segments, segment_pos, captures, extra_params, catch_all):
+        if segment_pos == len(segments):
+            if node.route is not None:
+                resolved = node.route.bind(captures, extra_params)
+
+                if resolved is not None:
+                    return resolved
+
+            if catch_all and node.catch_all is not None:
+                return node.catch_all.bind(captures + [''], extra_params)
+
+            return None
+
+        segment = segments[segment_pos]
+
+        child = node.static.get(segment)
+        if child is not None:
+            resolved = self._find(child, segments, segment_pos + 1, captures, extra_params, catch_all)
+
+            if resolved is not None:
+                return resolved
+
+        for test, child in node.typed.values():
+            if test(segment):
+                resolved = self._find(child, segments, segment_pos + 1, captures + [segment], extra_params, catch_all)
+
+                if resolved is not None:
+                    return resolved
+
+        for regex, child in node.patterns.values():
+            extracted = regex.fullmatch(segment)
+
+            if extracted:
+                resolved = self._find(child, segments, segment_pos + 1, captures + [extracted.groupdict()], extra_params, catch_all)
+
+                if resolved is not None:
+                    return resolved
+
+        if node.param is not None and segment:
+            resolved = self._find(node.param, segments, segment_pos + 1, captures + [segment], extra_params, catch_all)
+
+            if resolved is not None:
+                return resolved
+
+        if catch_all and node.catch_all is not None:
+            return node.catch_all.bind(captures + ['/'.join(segments[segment_pos:])], extra_params)
+
+        return None
+
+    # ----
+    def resolve(self, text, extra_params=None):
+        """
+        Finds the route of a request without calling its function.
+        ----
+        text (str) : "METHOD:/path"; a query string is ignored
+        extra_params (dict) : Extra parameters to be passed to the function
+        --
+        Returns (RegexMatch | None): Call it to run the function; None if no route matched
+        """
+
+        extra_params = {} if extra_params is None else extra_params
+        method, _, path = text.partition(':')
+        path = path.partition('?')[0]
+
+        tree = self._trees.get(method)
+        segments = path[1:].split('/') if tree is not None and path.startswith('/') else None
+
+        if self._fallback is None:
+            return None if segments is None else self._find(tree, segments, 0, [], extra_params, True)
+
+        # Fallback routes are more specific than catch-alls, so those are only tried after them
+        resolved = None if segments is None else self._find(tree, segments, 0, [], extra_params, False)
+
+        if resolved is None:
+            resolved = self._fallback.resolve(f'{method}:{path}', extra_params)
+
+        if resolved is None and segments is not None:
+            resolved = self._find(tree, segments, 0, [], extra_params, True)
+
+        return resolved
+
+    # ----
+    def match(self, text, extra_params=None):
+        """
+        Calls the function of the request's route; behaves like RegexCollection.match.
+        ----
+        text (str) : "METHOD:/path"; a query string is ignored
+        extra_params (dict) : Extra parameters to be passed to the function
+        --
+        Returns (tuple): (bool) found route, function result
+        """
+
+        resolved = self.resolve(text, extra_params)
+
+        if resolved is None:
+            return False, False
+
+        return True, resolved()
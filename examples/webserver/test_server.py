@@ -0,0 +1,446 @@
+import asyncio
+import datetime
+import http.client
+import logging
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from router import Router
+from webserver import AsyncWebServer, PooledWebServer, ThreadedWebServer, build_file_response, build_http_response
+
+
+# Each check starts its own server on a free port and returns {description: (result, expected)}
+
+
+def start_server(server_class, **kwargs):
+    server = server_class('localhost', 0, **kwargs)
+
+    @server.add_path('GET:/hello')
+    def hello():
+        return build_http_response('hello', 'text/plain')
+
+    @server.add_path('POST:/echo')
+    def echo(form_data=None):
+        return build_http_response(form_data, 'text/plain')
+
+    server.start()
+
+    return server
+
+
+def exchange(port, data, timeout=2.0):
+    """
+    data (bytes | list) : What to send; a list is sent one part at a time so the server receives it in pieces
+    ----
+    Returns (list): (int) status of every response the server sent for data before it closed the connection
+    """
+
+    received = b''
+
+    with socket.create_connection(('localhost', port), timeout=timeout) as connection:
+        for part in data if type(data) is list else [data]:
+            connection.sendall(part)
+            time.sleep(0.02)
+
+        try:
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+
+                received += chunk
+
+        except socket.timeout:
+            pass
+
+    return [int(status) for status in re.findall(rb'HTTP/1\.[01] (\d{3}) ', received)]
+
+
+def request(connection, method, path, body=None, headers=None):
+    """
+    Returns (tuple): (int) status, (str) body
+    """
+
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+
+    return response.status, response.read().decode()
+
+
+# ================================
+def check_router():
+    router = Router()
+
+    def bind(expression):
+        router.add(expression)(lambda **kwargs: (expression, kwargs))
+
+    for expression in ['GET:/', 'GET:/<filepath>', 'GET:/api/hello', 'POST:/api/hello', 'GET:/blog/posts/<post_id>',
+                       'GET:/users/<id:int>', 'GET:/users/me', 'GET:/users/<name>/profile', r'GET:/files/<name>\.<ext>',
+                       'GET:/days/<day:date>', 'GET:/hex/<value=[0-9a-f]+>', 'GET:/re/<x=a/b>']:
+        bind(expression)
+
+    router.prepare()
+
+    def route(text):
+        resolved = router.resolve(text)
+        return resolved and resolved()
+
+    try:
+        bind('GET:/users/<other:int>')
+        duplicate = None
+    except Exception as ex:
+        duplicate = str(ex)
+
+    try:
+        router.add('GET:/x/<a>/y')(lambda b: b)
+        unaccepted = None
+    except Exception as ex:
+        unaccepted = str(ex)
+
+    return {
+        'root'                              : (route('GET:/'), ('GET:/', {})),
+        'static segments'                   : (route('GET:/api/hello'), ('GET:/api/hello', {})),
+        'query string ignored'              : (route('GET:/api/hello?x=1'), ('GET:/api/hello', {})),
+        'one tree per method'               : ((route('POST:/api/hello'), route('DELETE:/api/hello')), (('POST:/api/hello', {}), None)),
+        'parameter'                         : (route('GET:/blog/posts/5'), ('GET:/blog/posts/<post_id>', {'post_id': '5'})),
+        'static beats typed'                : (route('GET:/users/me'), ('GET:/users/me', {})),
+        'typed value converted'             : (route('GET:/users/12'), ('GET:/users/<id:int>', {'id': 12})),
+        'typed mismatch falls through'      : (route('GET:/users/bob'), ('GET:/<filepath>', {'filepath': 'users/bob'})),
+        'parameter before static segment'   : (route('GET:/users/12/profile'), ('GET:/users/<name>/profile', {'name': '12'})),
+        'pattern segment'                   : (route('GET:/files/a.txt'), (r'GET:/files/<name>\.<ext>', {'name': 'a', 'ext': 'txt'})),
+        'typed pattern'                     : (route('GET:/hex/ff'), ('GET:/hex/<value=[0-9a-f]+>', {'value': 'ff'})),
+        'date converted'                    : (route('GET:/days/2024-02-03'), ('GET:/days/<day:date>', {'day': datetime.date(2024, 2, 3)})),
+        'invalid date falls through'        : (route('GET:/days/2024-02-30'), ('GET:/<filepath>', {'filepath': 'days/2024-02-30'})),
+        'last parameter takes the rest'     : (route('GET:/blog/posts/5/6'), ('GET:/blog/posts/<post_id>', {'post_id': '5/6'})),
+        'pattern with / in fallback'        : (route('GET:/re/a/b'), ('GET:/re/<x=a/b>', {'x': 'a/b'})),
+        'no route'                          : (route('POST:/nope'), None),
+        'conflicting route rejected'        : (duplicate, 'Route "GET:/users/<other:int>" conflicts with "GET:/users/<id:int>"'),
+        'unaccepted parameter rejected'     : (unaccepted, '<lambda>() cannot accept a of route "GET:/x/<a>/y"'),
+    }
+
+
+# ================================
+def check_server_routes(server_class=ThreadedWebServer):
+    server = start_server(server_class)
+
+    @server.add_path('GET:/users/<id:int>')
+    def user(id):
+        return build_http_response(f'{type(id).__name__} {id}', 'text/plain')
+
+    @server.add_path('GET:/users/me')
+    def me():
+        return build_http_response('me', 'text/plain')
+
+    try:
+        connection = http.client.HTTPConnection('localhost', server.port, timeout=5)
+        routed = [request(connection, 'GET', path) for path in ('/users/12', '/users/me', '/users/12?full=1')]
+        missing = [request(connection, method, path)[0] for method, path in (('GET', '/users/bob'), ('DELETE', '/hello'))]
+        connection.close()
+
+    finally:
+        server.shutdown()
+
+    return {
+        'routes served'                     : (routed, [(200, 'int 12'), (200, 'me'), (200, 'int 12')]),
+        '404 without a route'               : (missing, [404, 404]),
+    }
+
+
+# ================================
+def check_keep_alive(server_class=ThreadedWebServer):
+    server = start_server(server_class)
+
+    try:
+        connection = http.client.HTTPConnection('localhost', server.port, timeout=5)
+        first = request(connection, 'GET', '/hello')
+        kept_socket = connection.sock
+        second = request(connection, 'POST', '/echo', body='a=1', headers={'Content-Type': 'text/plain'})
+        same_socket = connection.sock is kept_socket
+
+        chunked = request(connection, 'POST', '/echo', body=iter([b'hel', b'lo']), headers={'Content-Type': 'text/plain'})
+        connection.close()
+
+        pipelined = b'GET /hello HTTP/1.1\r\nHost: x\r\n\r\nGET /hello HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n'
+        body = b'POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: %s\r\n\r\n12345'
+
+        return {
+            'requests on one connection'        : ((first, second, same_socket), ((200, 'hello'), (200, 'a=1'), True)),
+            'chunked body'                      : (chunked, (200, 'hello')),
+            'pipelined requests'                : (exchange(server.port, pipelined), [200, 200]),
+            'HTTP/1.0 closes by default'        : (exchange(server.port, b'GET /hello HTTP/1.0\r\n\r\n'), [200]),
+            'negative Content-Length'           : (exchange(server.port, body % b'-5'), [400]),
+            'malformed Content-Length'          : (exchange(server.port, body % b'5x'), [400]),
+            'negative chunk size'               : (exchange(server.port, b'POST /echo HTTP/1.1\r\nHost: x\r\n'
+                                                            b'Transfer-Encoding: chunked\r\n\r\n-5\r\n12345\r\n0\r\n\r\n'), [400]),
+            'body too large'                    : (exchange(server.port, body % b'99999999'), [413]),
+        }
+
+    finally:
+        server.shutdown()
+
+
+# ================================
+def check_async_server():
+    server = AsyncWebServer('localhost', 0)
+
+    @server.add_path('GET:/thread')
+    def thread():
+        return build_http_response(str(threading.current_thread() is server._thread), 'text/plain')
+
+    @server.add_path('GET:/wait')
+    async def wait():
+        await asyncio.sleep(0.2)
+        return build_http_response(str(threading.current_thread() is server._thread), 'text/plain')
+
+    server.start()
+
+    # Cancelled connections must not be logged by asyncio while shutting down
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    logging.getLogger('asyncio').addHandler(handler)
+
+    try:
+        waiting = []
+        threads = [threading.Thread(target=lambda: waiting.append(exchange(server.port, b'GET /wait HTTP/1.1\r\nHost: x\r\n'
+                                                                            b'Connection: close\r\n\r\n')))
+                   for _ in range(10)]
+
+        start = time.perf_counter()
+        for waiter in threads:
+            waiter.start()
+        for waiter in threads:
+            waiter.join()
+        waited = time.perf_counter() - start
+
+        connection = http.client.HTTPConnection('localhost', server.port, timeout=5)
+        handlers = (request(connection, 'GET', '/thread'), request(connection, 'GET', '/wait'))
+
+        idle = [socket.create_connection(('localhost', server.port), timeout=5) for _ in range(20)]
+        time.sleep(0.2)
+
+        start = time.perf_counter()
+        server.shutdown()
+        shutdown = time.perf_counter() - start
+
+        closed = sum(connection.recv(1) == b'' for connection in idle)
+
+        for connection in idle:
+            connection.close()
+
+    finally:
+        logging.getLogger('asyncio').removeHandler(handler)
+        server.shutdown()
+
+    return {
+        'coroutine handlers wait together'  : ((sum(waiting, []), waited < 1.5), ([200] * 10, True)),
+        'where handlers run'                : (handlers, ((200, 'False'), (200, 'True'))),
+        'shutdown closes open connections'  : ((closed, shutdown < 2), (20, True)),
+        'nothing logged on shutdown'        : (len(logged), 0),
+    }
+
+
+# ================================
+def check_static_files(server_class=ThreadedWebServer):
+    with tempfile.TemporaryDirectory() as root:
+        server = start_server(server_class)
+
+        @server.add_path('GET:/static/<filename>')
+        def static(filename, headers):
+            return build_file_response(os.path.join(root, filename), headers=headers)
+
+        small = b'body { color: red; }'
+        large = bytes(range(256)) * 1024
+
+        with open(os.path.join(root, 'small.css'), 'wb') as file:
+            file.write(small)
+        with open(os.path.join(root, 'large.bin'), 'wb') as file:
+            file.write(large)
+        os.mkdir(os.path.join(root, 'folder'))
+
+        try:
+            connection = http.client.HTTPConnection('localhost', server.port, timeout=5)
+
+            connection.request('GET', '/static/small.css')
+            response = connection.getresponse()
+            first = (response.status, response.read(), response.getheader('Content-Type'))
+            etag, last_modified = response.getheader('ETag'), response.getheader('Last-Modified')
+
+            by_etag = request(connection, 'GET', '/static/small.css', headers={'If-None-Match': etag})
+            by_date = request(connection, 'GET', '/static/small.css', headers={'If-Modified-Since': last_modified})
+            other_etag = request(connection, 'GET', '/static/small.css', headers={'If-None-Match': '"other"'})
+
+            connection.request('GET', '/static/large.bin')
+            response = connection.getresponse()
+            sent = (response.status, response.read() == large, response.getheader('ETag') is not None)
+
+            # Same size, later modification time: the cached response must be replaced
+            stat = os.stat(os.path.join(root, 'small.css'))
+            with open(os.path.join(root, 'small.css'), 'wb') as file:
+                file.write(small.upper())
+            os.utime(os.path.join(root, 'small.css'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 10))
+
+            connection.request('GET', '/static/small.css', headers={'If-None-Match': etag})
+            response = connection.getresponse()
+            changed = (response.status, response.read(), response.getheader('ETag') != etag)
+
+            missing = request(connection, 'GET', '/static/missing.css')[0]
+            folder = request(connection, 'GET', '/static/folder')[0]
+            connection.close()
+
+        finally:
+            server.shutdown()
+
+    return {
+        'file with validators'              : ((first, etag is not None, last_modified is not None), ((200, small, 'text/css'), True, True)),
+        '304 on If-None-Match'              : (by_etag, (304, '')),
+        '304 on If-Modified-Since'          : (by_date, (304, '')),
+        '200 on other ETag'                 : (other_etag, (200, small.decode())),
+        'large file sent whole'             : (sent, (200, True, True)),
+        'changed file served again'         : (changed, (200, small.upper(), True)),
+        'missing file and directory'        : ((missing, folder), (404, 404)),
+    }
+
+
+# ================================
+def check_request_reading(server_class=ThreadedWebServer):
+    server = start_server(server_class)
+
+    @server.add_path('GET:/params')
+    def params(**kwargs):
+        return build_http_response(','.join(sorted(kwargs)), 'text/plain')
+
+    @server.add_path('GET:/plain')
+    def plain():
+        return build_http_response('plain', 'text/plain')
+
+    @server.add_path('GET:/token')
+    def token(headers):
+        return build_http_response(f'{headers["X-TOKEN"]} {headers.get("x-token")} {"X-Token" in headers}', 'text/plain')
+
+    try:
+        pipelined = b'GET /hello HTTP/1.1\r\nHost: x\r\n\r\nGET /hello HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n'
+        # Breaks inside the request line, inside the blank line ending the first head and inside the second head
+        split = exchange(server.port, [pipelined[:10], pipelined[10:31], pipelined[31:33], pipelined[33:60], pipelined[60:]])
+
+        large = 'x' * (200 * 1024)
+        connection = http.client.HTTPConnection('localhost', server.port, timeout=5)
+        echoed = request(connection, 'POST', '/echo', body=large, headers={'Content-Type': 'text/plain'})
+        after_large = request(connection, 'GET', '/hello')
+
+        with_query = request(connection, 'GET', '/params?a=1')
+        without_query = request(connection, 'GET', '/params')
+        plain = request(connection, 'GET', '/plain?a=1')
+        token = request(connection, 'GET', '/token', headers={'x-Token': 'abc'})
+        connection.close()
+
+        too_large = exchange(server.port, b'GET /hello HTTP/1.1\r\nHost: x\r\nX-Big: ' + b'x' * (70 * 1024) + b'\r\n\r\n')
+
+    finally:
+        server.shutdown()
+
+    return {
+        'requests split across receives'    : (split, [200, 200]),
+        'body larger than the buffer'       : ((echoed[0], echoed[1] == large, after_large), (200, True, (200, 'hello'))),
+        'head larger than the buffer'       : (too_large, [431]),
+        'only available params passed'      : ((with_query, without_query), ((200, 'headers,url_params'), (200, 'headers'))),
+        'params not taken are not passed'   : (plain, (200, 'plain')),
+        'headers ignore case'               : (token, (200, 'abc abc True')),
+    }
+
+
+# ================================
+def check_pooled_server():
+    server = start_server(PooledWebServer, workers=1, queue_size=1)
+
+    try:
+        # An idle keep-alive connection holds the only worker and a second one fills the queue
+        held = socket.create_connection(('localhost', server.port), timeout=5)
+        time.sleep(0.1)
+        queued = socket.create_connection(('localhost', server.port), timeout=5)
+        time.sleep(0.1)
+
+        with socket.create_connection(('localhost', server.port), timeout=5) as rejected:
+            start = time.perf_counter()
+            overloaded = rejected.recv(65536)
+            rejected_in = time.perf_counter() - start
+
+        full = server.stats()
+
+        held.close()
+        queued.close()
+
+        deadline = time.perf_counter() + 2
+        while (server.stats()['busy_workers'] or server.stats()['queue_depth']) and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+        served = exchange(server.port, b'GET /hello HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+        stats = server.stats()
+
+    finally:
+        server.shutdown()
+
+    return {
+        'full queue answers 503 at once'    : ((overloaded.split(b'\r\n', 1)[0], rejected_in < 0.5), (b'HTTP/1.1 503 Service Unavailable', True)),
+        '503 closes and asks to retry'      : ((b'Connection: close' in overloaded, b'Retry-After: 1' in overloaded), (True, True)),
+        'stats while full'                  : ({key: full[key] for key in ('workers', 'busy_workers', 'queue_depth', 'queue_size', 'accepted', 'rejected')},
+                                               {'workers': 1, 'busy_workers': 1, 'queue_depth': 1, 'queue_size': 1, 'accepted': 2, 'rejected': 1}),
+        'served once connections close'     : (served, [200]),
+        'stats after'                       : ((stats['accepted'], stats['handled'], stats['rejected'], stats['queue_depth'], stats['wait_max'] > 0),
+                                               (3, 3, 1, 0, True)),
+    }
+
+
+# ================================
+server_checks = {
+    'router'                    : check_router,
+    'server routes'             : check_server_routes,
+    'server routes (asyncio)'   : lambda: check_server_routes(AsyncWebServer),
+    'keep-alive'                : check_keep_alive,
+    'keep-alive (pooled)'       : lambda: check_keep_alive(PooledWebServer),
+    'keep-alive (asyncio)'      : lambda: check_keep_alive(AsyncWebServer),
+    'request reading'           : check_request_reading,
+    'request reading (asyncio)' : lambda: check_request_reading(AsyncWebServer),
+    'static files'              : check_static_files,
+    'static files (asyncio)'    : lambda: check_static_files(AsyncWebServer),
+    'pooled'                    : check_pooled_server,
+    'asyncio'                   : check_async_server,
+}
+
+
+def run_server_tests(show_results=True):
+    passed = 0
+    failed = 0
+
+    for feature, check in server_checks.items():
+        if show_results:
+            print(f'\n({feature})')
+
+        for i, (test, (result, expected)) in enumerate(check().items()):
+            success = result == expected
+
+            if success:
+                passed += 1
+            else:
+                failed += 1
+
+            if show_results:
+                pad_before = " " * max(0, (50 - len(test)))
+                pad_after = " " * max(0, (60 - len(str(result))))
+                if not success: print('--')
+                print(f'{i:<4}: {test} {pad_before} => {result} {pad_after} || {"Passed" if success else f"Failed ** (expected {expected})"}')
+                if not success: print('--')
+
+    if show_results:
+        print(f'\n{passed + failed}/{passed} passed, {failed} failed')
+
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run_server_tests() else 0)
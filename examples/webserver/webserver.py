@@ -1,24 +1,23 @@
+import asyncio
+import collections
+import collections.abc
+import email.utils
+import functools
+import inspect
 import json
 import mimetypes
-import pathlib
+import os
+import queue
 import re
 import socket
 import socketserver
-import sys
 import threading
 import time
 import urllib.parse
 
-from http.server import BaseHTTPRequestHandler
-from io import BytesIO
-
-try:
-    from pyretree import pyretree
-except ImportError:
-    # Gross way to import from the repository structure
-    sys.path.append(str(pathlib.Path(__file__).parent.parent.parent.parent.absolute()))
-    from pyretree import pyretree
+from concurrent.futures import ThreadPoolExecutor
 
+from router import Router
 
 # --------
 def build_http_response(data, content_type='text/html', response_code='200 OK'):
@@ -32,12 +31,13 @@ def build_http_response(data, content_type='text/html', response_code='200 OK'):
     Returns (bytes) of the packaged HTTP response.
     """
 
+    # Content-Length counts bytes; clients reading the next response on the same connection rely on it
+    if content_type.startswith('text') and type(data) != bytes:
+        data = bytes(data, 'utf-8')
+
     http_header = f'HTTP/1.1 {response_code}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n'
 
-    if content_type.startswith('text') and type(data) != bytes:
-        return bytes(http_header + data, 'utf-8')
-    else:
-        return bytes(http_header, 'utf-8') + data
+    return bytes(http_header, 'utf-8') + data
 
 # ----
 EXTRACT_HTML_HEAD_RE = re.compile('<% head %>(.+)<% /head %>', re.MULTILINE | re.DOTALL)
@@ -70,7 +70,7 @@ def _recursive_json_load(data):
             except json.decoder.JSONDecodeError:
                 pass
 
-        else:
+        elif type(val) == dict:
             _recursive_json_load(data[key])
 
 def build_json_response(data, response_code='200 OK'):
@@ -91,31 +91,162 @@ def build_json_response(data, response_code='200 OK'):
     return bytes(f'HTTP/1.1 {response_code}\r\nContent-Type: application/json\r\nContent-Length: {len(encoded_json)}\r\n\r\n{encoded_json}', 'utf-8')
 
 # ----
-def build_file_response(path, content_type=None):
+def _add_headers(response, headers):
     """
-    path (str) : Path to file relative to www-root folder next to your server script
-    content_type (str) : Mimetype; if set to None mimetype will automatically be determined
+    response (bytes | FileResponse) : HTTP response
+    headers (bytes) : Header lines, each ending with CRLF
     ----
-    Return (bytes) HTTP response containing file data. If content_type is set of determined
-    to be text/html, the file will be parsed as a template. 404's if <path> is a directory.
+    Returns (bytes | FileResponse): response with headers added right after its status line
     """
 
-    try:
-        path = urllib.parse.unquote(str(path)).replace('..', '')
+    if isinstance(response, FileResponse):
+        return FileResponse(_add_headers(response.head, headers), response.path, response.size)
 
+    status_end = response.index(b'\r\n') + 2
+    return response[:status_end] + headers + response[status_end:]
+
+# ----
+class FileResponse:
+    __slots__ = ('head', 'path', 'size')
+
+    def __init__(self, head, path, size):
+        """
+        HTTP response whose body is sent straight from a file with sendfile(), without reading it into memory.
+        ---
+        head (bytes) : Status line and headers
+        path (str) : File holding the body
+        size (int) : Number of bytes of the file to send
+        """
+
+        self.head = head
+        self.path = path
+        self.size = size
+
+# ----
+class _FileCache:
+
+    def __init__(self, max_entries=256, sendfile_size=64 * 1024):
+        """
+        LRU cache of prepared file responses. Entries are checked against the file's modification time and size on
+        every use, so changed files are picked up without restarting the server.
+        ----
+        max_entries (int) : Number of files kept
+        sendfile_size (int) : Files at least this large are not kept in memory but sent with sendfile()
+        """
+
+        self.max_entries = max_entries
+        self.sendfile_size = sendfile_size
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    # ----
+    def _prepare(self, path, content_type, stat):
+        # Returns (dict) the responses of one version of a file
         content_type = content_type if content_type is not None else mimetypes.guess_type(path)[0]
         if content_type is None:
             # 404 on directories
-            return HTTP_404()
+            return {'response': HTTP_404(), 'not_modified': None}
 
-        mode = 'r' if content_type.startswith('text') else 'rb'
-        with open(path, mode) as file:
-            data = file.read()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        validators = bytes(f'ETag: {etag}\r\nLast-Modified: {last_modified}\r\n', 'utf-8')
 
         if content_type == 'text/html':
-            return build_html_response(data)
+            with open(path, 'r', encoding='utf-8') as file:
+                response = build_html_response(file.read())
+
+        elif stat.st_size >= self.sendfile_size:
+            head = bytes(f'HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {stat.st_size}\r\n\r\n', 'utf-8')
+            response = FileResponse(head, path, stat.st_size)
 
-        return build_http_response(data, content_type=content_type)
+        else:
+            with open(path, 'rb') as file:
+                response = build_http_response(file.read(), content_type=content_type)
+
+        return {
+            'response': _add_headers(response, validators),
+            'not_modified': b'HTTP/1.1 304 Not Modified\r\n' + validators + b'\r\n',
+            'etag': etag,
+            'mtime': int(stat.st_mtime),
+        }
+
+    # ----
+    def get(self, path, content_type, headers):
+        """
+        Returns (bytes | FileResponse): Response for the file at path, 304 if headers show the client has it already
+        """
+
+        stat = os.stat(path)
+        key = (path, content_type)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._entries.get(key)
+
+            if cached is not None and cached[0] == version:
+                self._entries.move_to_end(key)
+                entry = cached[1]
+            else:
+                entry = None
+
+        if entry is None:
+            entry = self._prepare(path, content_type, stat)
+
+            with self._lock:
+                self._entries[key] = (version, entry)
+                self._entries.move_to_end(key)
+
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if headers is not None and entry['not_modified'] is not None and _not_modified(headers, entry):
+            return entry['not_modified']
+
+        return entry['response']
+
+    # ----
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# ----
+def _not_modified(headers, entry):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232, section 6)
+    if_none_match = headers.get('If-None-Match')
+
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or entry['etag'] in (tag.strip() for tag in if_none_match.split(','))
+
+    if_modified_since = headers.get('If-Modified-Since')
+
+    if if_modified_since is not None:
+        try:
+            return entry['mtime'] <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+_file_cache = _FileCache()
+
+# ----
+def build_file_response(path, content_type=None, headers=None):
+    """
+    path (str) : Path to file relative to www-root folder next to your server script
+    content_type (str) : Mimetype; if set to None mimetype will automatically be determined
+    headers (dict) : Request headers (the headers parameter of path functions); used to answer
+                     If-None-Match / If-Modified-Since with 304 Not Modified
+    ----
+    Return (bytes | FileResponse) HTTP response containing file data. If content_type is set of determined
+    to be text/html, the file will be parsed as a template. 404's if <path> is a directory. Responses are
+    cached until the file changes; large files are sent with sendfile() instead of being read.
+    """
+
+    try:
+        path = urllib.parse.unquote(str(path)).replace('..', '')
+
+        return _file_cache.get(path, content_type, headers)
 
     except FileNotFoundError:
         return HTTP_404()
@@ -135,149 +266,764 @@ def HTTP_204(msg='204 No Content'): return build_http_response(msg, response_cod
 def HTTP_400(msg='400 Bad Request'): return build_http_response(msg, response_code='400 Bad Request')
 def HTTP_403(msg='403 Forbidden'): return build_http_response(msg, response_code='403 Forbidden')
 def HTTP_404(msg='404 Not Found'): return build_http_response(msg, response_code='404 Not Found')
+def HTTP_413(msg='413 Payload Too Large'): return build_http_response(msg, response_code='413 Payload Too Large')
+def HTTP_431(msg='431 Request Header Fields Too Large'): return build_http_response(msg, response_code='431 Request Header Fields Too Large')
 def HTTP_500(msg='500 Internal Server Error'): return build_http_response(msg, response_code='500 Internal Server Error')
+def HTTP_503(msg='503 Service Unavailable'): return build_http_response(msg, response_code='503 Service Unavailable')
 
 # --------
-class _HTTPRequest(BaseHTTPRequestHandler):
-    # https://stackoverflow.com/questions/4685217/parse-raw-http-headers
+class _HTTPError(Exception):
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+# ----
+class _Headers(dict):
+    # Request headers by lower-cased name; lookups ignore case
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+# ----
+class _Request:
+
+    def __init__(self, head):
+        """
+        A parsed request. Only the request line and headers are decoded here; url_params and form_data are parsed
+        the first time they are used.
+        ----
+        head (bytes-like) : Request line and headers
+        """
+
+        lines = str(head, encoding='iso-8859-1').split('\n')
+        request_line = lines[0].rstrip('\r').split(' ')
+
+        if len(request_line) != 3 or not request_line[2].startswith('HTTP/1.'):
+            raise _HTTPError(HTTP_400())
+
+        self.command, target, self.version = request_line
+        self.path, self.has_query, self.query_string = target.partition('?')
+
+        self.headers = _Headers()
+        for line in lines[1:]:
+            line = line.rstrip('\r')
+            if not line:
+                break
+
+            name, separator, value = line.partition(':')
+            if not separator:
+                raise _HTTPError(HTTP_400())
+
+            name = name.lower()
+            value = value.strip()
+            previous = dict.get(self.headers, name)
+            dict.__setitem__(self.headers, name, value if previous is None else f'{previous}, {value}')
+
+        # HTTP/1.1 connections stay open unless the client asks otherwise; HTTP/1.0 ones only if it asks to
+        connection = self.headers.get('Connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            self.close_connection = 'keep-alive' not in connection
+        else:
+            self.close_connection = 'close' in connection
+
+        self.expect_100 = self.version != 'HTTP/1.0' and self.headers.get('Expect', '').lower() == '100-continue'
+
+        self.body = b''
+
+    # ----
+    def body_length(self):
+        """
+        Returns (int | None): Length of the body, or None if it is chunked
+        """
+
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return None
+
+        content_length = self.headers.get('Content-Length', '0')
+
+        # Plain digits only; int() also takes a sign, which would move the reader back into consumed bytes
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise _HTTPError(HTTP_400())
+
+        return int(content_length)
+
+    # ----
+    @functools.cached_property
+    def url_params(self):
+        url_params = {}
+
+        for param in self.query_string.split('&'):
+            parts = param.split('=')
+            url_params[parts[0]] = '='.join(parts[1:])
+
+        return url_params
+
+    # ----
+    @functools.cached_property
+    def form_data(self):
+        return _parse_form_data(self.headers, self.body)
+
+# ----
+class _RequestParams(collections.abc.Mapping):
+
+    def __init__(self, request):
+        """
+        The extra_params of a request. Values are only computed when a path function asks for them, so a request
+        whose function does not take form_data never decodes its body.
+        """
+
+        self._request = request
+        self._names = ('headers',)
+
+        if request.command in ['POST', 'PUT']:
+            self._names += ('form_data',)
+
+        if request.has_query:
+            self._names += ('url_params',)
 
-    def __init__(self, request_text):
-        self.rfile = BytesIO(request_text)
-        self.raw_requestline = self.rfile.readline()
-        self.error_code = self.error_message = None
-        self.path = None
-        self.parse_request()
+    # ----
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+
+        return getattr(self._request, name)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+# ----
+_MAX_HEADER_SIZE = 64 * 1024
+_MAX_BODY_SIZE = 16 * 1024 * 1024
+
+def _chunk_size(line):
+    """
+    Returns (int): The size on the line starting a chunk of a chunked body
+    """
+
+    size = line.split(b';')[0].strip()
+
+    # Hex digits only; int() also takes a sign, which would move the reader back into consumed bytes
+    if not size or size.strip(b'0123456789abcdefABCDEF'):
+        raise _HTTPError(HTTP_400())
+
+    return int(size, 16)
+
+# ----
+class _RequestReader:
+
+    def __init__(self, connection, buffer_size=_MAX_HEADER_SIZE):
+        """
+        Buffered reader of the requests sent over one connection. Data is received straight into one buffer that
+        is reused for every request, and heads and bodies are returned as memoryviews of it, which stay valid until
+        the next request is read. Bytes received past the end of a request are kept for the next one.
+        ----
+        connection (socket.socket) : Connected client socket; its timeout applies to every receive
+        buffer_size (int) : Size of the buffer, and so the largest head accepted; larger bodies get their own buffer
+        """
+
+        self._connection = connection
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+        # Received bytes not read yet are self._buffer[self._start:self._end]
+        self._start = self._end = 0
+
+    # ----
+    def _compact(self):
+        # Move the unread bytes to the front of the buffer to make room after them
+        unread = self._end - self._start
+        self._view[:unread] = self._view[self._start:self._end]
+        self._start, self._end = 0, unread
+
+    # ----
+    def _receive(self):
+        if self._end == len(self._buffer):
+            self._compact()
+
+        received = self._connection.recv_into(self._view[self._end:])
+
+        if not received:
+            raise ConnectionError('Connection closed by client')
+
+        self._end += received
+
+    # ----
+    def _find_head_end(self, scanned):
+        """
+        Returns (tuple): (int) end of the head (after its blank line) or -1, (int) where to resume searching once
+                         more data is received
+        """
+
+        newline = self._buffer.find(b'\n', scanned, self._end)
+
+        while newline >= 0:
+            following = self._buffer[newline + 1:min(newline + 3, self._end)]
+
+            if following[:1] == b'\n':
+                return newline + 2, None
+
+            if following == b'\r\n':
+                return newline + 3, None
+
+            # Cannot tell yet whether the line after this one is blank
+            if following in (b'', b'\r'):
+                return -1, newline
+
+            newline = self._buffer.find(b'\n', newline + 1, self._end)
+
+        return -1, self._end
+
+    # ----
+    def read_head(self):
+        """
+        Returns (memoryview | None): Request line and headers including the blank line ending them, or None if the
+        client closed the connection between requests
+        """
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        # Received bytes are searched once, apart from a line ending split across receives
+        scanned = self._start
+
+        while True:
+            end, scanned = self._find_head_end(scanned)
+
+            if end >= 0:
+                break
+
+            if self._start == 0 and self._end == len(self._buffer):
+                raise _HTTPError(HTTP_431())
+
+            start = self._start
+
+            try:
+                self._receive()
+            except ConnectionError:
+                if self._start < self._end:
+                    raise
+
+                return None
+
+            # Compacting moved the unread bytes to the front
+            scanned -= start - self._start
+
+        head = self._view[self._start:end]
+        self._start = end
+
+        return head
+
+    # ----
+    def read_body(self, length):
+        if length > _MAX_BODY_SIZE:
+            raise _HTTPError(HTTP_413())
+
+        if length > len(self._buffer):
+            # Received straight into a buffer of its own
+            body = memoryview(bytearray(length))
+            received = self._end - self._start
+            body[:received] = self._view[self._start:self._end]
+            self._start = self._end = 0
+
+            while received < length:
+                received_now = self._connection.recv_into(body[received:])
+
+                if not received_now:
+                    raise ConnectionError('Connection closed by client')
+
+                received += received_now
+
+            return body
+
+        if self._start + length > len(self._buffer):
+            self._compact()
+
+        while self._end - self._start < length:
+            self._receive()
+
+        body = self._view[self._start:self._start + length]
+        self._start += length
+
+        return body
+
+    # ----
+    def _read_line(self):
+        while True:
+            end = self._buffer.find(b'\n', self._start, self._end)
+            if end >= 0:
+                line = bytes(self._view[self._start:end + 1])
+                self._start = end + 1
+                return line.strip()
+
+            if self._start == 0 and self._end == len(self._buffer):
+                raise _HTTPError(HTTP_400())
+
+            self._receive()
+
+    # ----
+    def read_chunked(self):
+        body = bytearray()
+
+        while True:
+            chunk_size = _chunk_size(self._read_line())
+
+            if chunk_size == 0:
+                # Skip trailers up to the blank line ending the body
+                while self._read_line():
+                    pass
+
+                return body
+
+            if len(body) + chunk_size > _MAX_BODY_SIZE:
+                raise _HTTPError(HTTP_413())
+
+            body += self.read_body(chunk_size)
+            self._read_line()
 
 # --------
+def _read_request(connection, reader):
+    """
+    Returns (_Request | None): The next request, or None if the client closed the connection between requests
+    """
+
+    head = reader.read_head()
+    if head is None:
+        return None
+
+    # Parsed before the body is read, which may move the head within the reader's buffer
+    request = _Request(head)
+    body_length = request.body_length()
+
+    if request.expect_100:
+        connection.sendall(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+    request.body = reader.read_chunked() if body_length is None else reader.read_body(body_length)
+
+    return request
+
+# ----
+class _AsyncRequestReader:
+
+    def __init__(self, stream, timeout):
+        """
+        Counterpart of _RequestReader for asyncio streams.
+        ----
+        stream (asyncio.StreamReader) : Reader of the connection; its limit bounds the length of header lines
+        timeout (float) : Seconds the headers, the body or each chunk of a chunked body may take to arrive
+        """
+
+        self._stream = stream
+        self._timeout = timeout
+
+    # ----
+    async def _read_line(self):
+        try:
+            return await self._stream.readline()
+        except ValueError:
+            # Line longer than the stream's limit
+            raise _HTTPError(HTTP_431())
+
+    # ----
+    async def _read_head(self):
+        lines = []
+        size = 0
+
+        while True:
+            line = await self._read_line()
+
+            if not line:
+                if lines:
+                    raise ConnectionError('Connection closed by client')
+
+                return None
+
+            lines.append(line)
+            size += len(line)
+
+            if size > _MAX_HEADER_SIZE:
+                raise _HTTPError(HTTP_431())
+
+            if line in (b'\r\n', b'\n'):
+                return b''.join(lines)
+
+    # ----
+    async def read_head(self):
+        """
+        Returns (bytes | None): Request line and headers including the blank line ending them, or None if the
+        client closed the connection between requests
+        """
+
+        return await asyncio.wait_for(self._read_head(), self._timeout)
+
+    # ----
+    async def read_body(self, length):
+        if length > _MAX_BODY_SIZE:
+            raise _HTTPError(HTTP_413())
+
+        return await asyncio.wait_for(self._stream.readexactly(length), self._timeout)
+
+    # ----
+    async def read_chunked(self):
+        chunks = []
+        size = 0
+
+        while True:
+            chunk_size = _chunk_size(await asyncio.wait_for(self._read_line(), self._timeout))
+
+            if chunk_size == 0:
+                # Skip trailers up to the blank line ending the body
+                await asyncio.wait_for(self._read_head(), self._timeout)
+                return b''.join(chunks)
+
+            size += chunk_size
+            if size > _MAX_BODY_SIZE:
+                raise _HTTPError(HTTP_413())
+
+            chunks.append(await self.read_body(chunk_size))
+            await asyncio.wait_for(self._read_line(), self._timeout)
+
+# ----
+async def _read_request_async(writer, reader):
+    # Counterpart of _read_request for asyncio streams
+    head = await reader.read_head()
+    if head is None:
+        return None
+
+    request = _Request(head)
+    body_length = request.body_length()
+
+    if request.expect_100:
+        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        await writer.drain()
+
+    request.body = await (reader.read_chunked() if body_length is None else reader.read_body(body_length))
+
+    return request
+
+# ----
 # multipart/form-data data parsing
-_MULTIPART_BOUNDARY_RE = re.compile('Content-Type: multipart/form-data; ?boundary=(.+)\\r\\n')
 _MULTIPART_DATA_RE = re.compile('Content-Disposition: form-data; name="(.+)"\\r\\n\\r\\n(.+)\\r\\n--')
 
+def _parse_form_data(headers, body):
+    """
+    headers (_Headers) : Request headers
+    body (bytes-like) : Request body
+    ----
+    Returns (dict | str): Parsed form fields, or the body itself if it is not form encoded
+    """
+
+    content_type = headers.get('Content-Type', '')
+    form_data = str(body, encoding='utf-8', errors='replace')
+
+    # multipart/form-data
+    if content_type.startswith('multipart/form-data'):
+        # Data separated by a specific boundary
+        multipart_boundary = content_type.partition('boundary=')[2].strip('"')
+        multiparts = form_data.split(multipart_boundary) if multipart_boundary else []
+
+        multipart_data = {}
+        for part in multiparts:
+            _result = _MULTIPART_DATA_RE.search(part)
+
+            if _result is not None:
+                key, val = _result.groups()
+                multipart_data[key] = val
+
+        return multipart_data
+
+    # x-www-form-urlencoded
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        form_pairs = form_data.split('&')
+        x_www_data = {}
+
+        # Data in format key=val&key2=val2
+        for pair in form_pairs:
+            try:
+                split_pairs = pair.split('=')
+                key = split_pairs[0]
+                val = '='.join(split_pairs[1:])
+
+                x_www_data[key] = val
+
+            except IndexError:
+                # Ignore malformed form data
+                pass
+
+        return x_www_data
+
+    # raw/binary/graphql
+    return form_data
+
+# ----
+def _route(path_handler, request):
+    """
+    Returns (bytes | FileResponse): The response of the handler of the request's path, or an error response
+    """
+
+    # Handlers only receive the url_params / form_data / headers they declare (see Router.add)
+    try:
+        success, response = path_handler.match(f'{request.command}:{request.path}', extra_params=_RequestParams(request))
+
+    except Exception as ex:
+        print(f'Exception: {str(ex)}')
+        return HTTP_500()
+
+    if not success:
+        return HTTP_404()
+
+    # async def handlers also work here, each on an event loop of its own
+    if inspect.iscoroutine(response):
+        try:
+            response = asyncio.run(response)
+
+        except Exception as ex:
+            print(f'Exception: {str(ex)}')
+            return HTTP_500()
+
+    return response
+
+# ----
+async def _route_async(path_handler, request, executor):
+    """
+    Counterpart of _route for the event loop. Coroutine handlers are awaited; other handlers run on executor so they
+    cannot block the loop.
+    --
+    Returns (bytes | FileResponse): The response of the handler of the request's path, or an error response
+    """
+
+    try:
+        resolved = path_handler.resolve(f'{request.command}:{request.path}', extra_params=_RequestParams(request))
+
+        if resolved is None:
+            return HTTP_404()
+
+        if inspect.iscoroutinefunction(resolved.callback):
+            return await resolved()
+
+        return await asyncio.get_running_loop().run_in_executor(executor, resolved)
+
+    except Exception as ex:
+        print(f'Exception: {str(ex)}')
+        return HTTP_500()
+
+# ----
+def _keep_alive(request, response):
+    """
+    Returns (tuple): (bool) whether the connection stays open after response, the response to send
+    """
+
+    if request.close_connection:
+        return False, response
+
+    # HTTP/1.1 connections stay open by default; HTTP/1.0 clients must be told when they do
+    if request.version == 'HTTP/1.0':
+        response = _add_headers(response, b'Connection: keep-alive\r\n')
+
+    return True, response
+
+# ----
+def _send_response(connection, response):
+    if not isinstance(response, FileResponse):
+        connection.sendall(response)
+        return
+
+    connection.sendall(response.head)
+
+    with open(response.path, 'rb') as file:
+        sent = connection.sendfile(file, 0, response.size)
+
+    # The file shrank since its response was prepared; the client is still waiting for the rest
+    if sent < response.size:
+        raise ConnectionError(f'Sent {sent} of {response.size} bytes of {response.path}')
+
+# ----
+async def _send_response_async(writer, response):
+    if not isinstance(response, FileResponse):
+        writer.write(response)
+        await writer.drain()
+        return
+
+    writer.write(response.head)
+    await writer.drain()
+
+    with open(response.path, 'rb') as file:
+        sent = await asyncio.get_running_loop().sendfile(writer.transport, file, 0, response.size)
+
+    if sent < response.size:
+        raise ConnectionError(f'Sent {sent} of {response.size} bytes of {response.path}')
+
+# --------
 class _ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
-    path_handler = None  # Prepared instance of pyretree.RegexCollection(separator='/')
+    path_handler = None  # Prepared Router
+    idle_timeout = 5.0   # Seconds a kept-alive connection may wait for its next request
 
     def handle(self):
-        data_bytes = self.request.recv(1024)
+        # Serve requests until the client closes the connection, asks to or stays idle for idle_timeout
+        self.request.settimeout(self.idle_timeout)
+        reader = _RequestReader(self.request)
+
+        try:
+            while True:
+                try:
+                    request = _read_request(self.request, reader)
+
+                except _HTTPError as ex:
+                    # The rest of the connection cannot be parsed reliably
+                    self.request.sendall(ex.response)
+                    return
 
-        if len(data_bytes) == 0:
-            # Ignore empty requests
+                if request is None:
+                    return
+
+                keep_alive, response = _keep_alive(request, _route(self.path_handler, request))
+                _send_response(self.request, response)
+
+                if not keep_alive:
+                    return
+
+        except (socket.timeout, ConnectionError):
             return
 
-        http_request = _HTTPRequest(data_bytes)
-        extra_params = {}
 
-        # Handle form data
-        if http_request.command in ['POST', 'PUT']:
-            data_str = str(data_bytes, encoding='utf-8')
-            separator = '\r\n\r\n' if '\r\n\r\n' in data_str else '\n\n'
-            request_parts = data_str.split(separator)
-            form_data = separator.join(request_parts[1:]) if len(request_parts) > 1 else ''
+class _ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
 
-            # multipart/form-data
-            multipart_boundary = _MULTIPART_BOUNDARY_RE.search(request_parts[0])
-            if multipart_boundary is not None:
-                # Data separated by a specific boundary
-                multipart_boundary = multipart_boundary.group(1)
-                multiparts = form_data.split(multipart_boundary)
+# ----
+# Sent as is to connections turned away by a full _PooledTCPServer; built once so overload costs as little as possible
+_OVERLOADED_RESPONSE = HTTP_503().replace(b'\r\n', b'\r\nConnection: close\r\nRetry-After: 1\r\n', 1)
 
-                multipart_data = {}
-                for part in multiparts:
-                    _result = _MULTIPART_DATA_RE.search(part)
+class _PooledTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128  # Listen backlog; connections wait in the accept queue below once accepted
 
-                    if _result is not None:
-                        key, val = _result.groups()
-                        multipart_data[key] = val
+    def __init__(self, server_address, request_handler, workers, queue_size):
+        """
+        TCP server handing accepted connections to a fixed number of worker threads through a bounded queue.
+        Connections arriving while the queue is full are answered with a 503 and closed.
+        """
 
-                extra_params['form_data'] = multipart_data
+        super().__init__(server_address, request_handler)
 
-            # x-www-form-urlencoded
-            elif 'Content-Type: application/x-www-form-urlencoded' in request_parts[0]:
-                form_pairs = form_data.split('&')
-                x_www_data = {}
+        # Only serve_forever's thread adds to the queue, so checking its size before adding is enough to bound it
+        self._queue = queue.Queue()
+        self._queue_size = queue_size
 
-                # Data in format key=val&key2=val2
-                for pair in form_pairs:
-                    try:
-                        split_pairs = pair.split('=')
-                        key = split_pairs[0]
-                        val = '='.join(split_pairs[1:])
+        self._stats_lock = threading.Lock()
+        self._stats = {'accepted': 0, 'rejected': 0, 'handled': 0, 'busy_workers': 0, 'wait_total': 0.0, 'wait_max': 0.0}
 
-                        x_www_data[key] = val
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
 
-                    except IndexError:
-                        # Ignore malformed form data
-                        pass
+    # ----
+    def process_request(self, request, client_address):
+        # Called by serve_forever's thread for every accepted connection
+        if self._queue.qsize() >= self._queue_size:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
 
-                extra_params['form_data'] = x_www_data
+            try:
+                request.settimeout(0)
+                request.send(_OVERLOADED_RESPONSE)
+            except OSError:
+                pass
 
-            # raw/binary/graphql
-            else:
-                extra_params['form_data'] = form_data
+            self.shutdown_request(request)
+            return
 
-        # Handle basic URL parameters
-        if len(http_request.path.split('?')) > 1:
-            url_params = {}
-            params = '?'.join(http_request.path.split('?')[1:]).split('&')
-            for param in params:
-                parts = param.split('=')
-                url_params[parts[0]] = '='.join(parts[1:])
+        with self._stats_lock:
+            self._stats['accepted'] += 1
 
-            http_request.path = http_request.path.split('?')[0]
-            extra_params['url_params'] = url_params
+        self._queue.put((request, client_address, time.perf_counter()))
 
+    # ----
+    def _work(self):
         while True:
-            success = error_handled = False
+            item = self._queue.get()
+
+            if item is None:
+                return
+
+            request, client_address, queued_at = item
+            wait = time.perf_counter() - queued_at
+
+            with self._stats_lock:
+                self._stats['handled'] += 1
+                self._stats['busy_workers'] += 1
+                self._stats['wait_total'] += wait
+                self._stats['wait_max'] = max(self._stats['wait_max'], wait)
 
             try:
-                success, response = self.path_handler.match(f'{http_request.command}:{http_request.path}', extra_params=extra_params)
-                break
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
 
-            except TypeError as ex:
-                # Handle unexcepted parameters / post data by ignoring them
-                ex_str = str(ex)
+                with self._stats_lock:
+                    self._stats['busy_workers'] -= 1
 
-                if ex_str.endswith("unexpected keyword argument 'url_params'"):
-                    extra_params.pop('url_params')
+    # ----
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
 
-                elif ex_str.endswith("unexpected keyword argument 'form_data'"):
-                    extra_params.pop('form_data')
+        wait_total = stats.pop('wait_total')
 
-                else:
-                    error_handled = True
-                    response = HTTP_400()
-                    break
+        stats['workers'] = len(self._workers)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_size'] = self._queue_size
+        stats['wait_avg'] = wait_total / stats['handled'] if stats['handled'] else 0.0
 
-            except Exception as ex:
-                print(f'Exception: {str(ex)}')
-                error_handled = True
-                response = HTTP_500()
-                break
+        return stats
 
-        if not success and not error_handled:
-           response = HTTP_404()
+    # ----
+    def server_close(self):
+        super().server_close()
 
-        self.request.sendall(response)
+        # Close connections still waiting for a worker; workers stop once their current connection ends
+        try:
+            while True:
+                item = self._queue.get_nowait()
 
+                if item is not None:
+                    self.shutdown_request(item[0])
 
-class _ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+        except queue.Empty:
+            pass
+
+        for _ in self._workers:
+            self._queue.put(None)
 
 
 # ----
-class ThreadedWebServer:
+class _WebServer:
 
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, idle_timeout=5.0):
         """
-        Multithreaded webserver for demonstrative purposes. No safety guarantees whatsoever.
-        ----
-        host (str) : Host for the server
-        port (int) : Port for the server
+        Routing and run_forever() shared by the servers, which provide start() and shutdown(); see
+        ThreadedWebServer and AsyncWebServer.
         """
-        
+
         self.host = host
         self.port = port
+        self.idle_timeout = idle_timeout
 
-        self.path_handler = pyretree.RegexCollection(separator='/')
+        self.path_handler = Router()
 
     # ----
     def add_path(self, path):
@@ -290,29 +1036,250 @@ class ThreadedWebServer:
 
         return self.path_handler.add(path)
 
+    # ----
+    def _prepare(self):
+        if not self.path_handler.prepared:
+            self.path_handler.prepare()
+
     # ----
     def run_forever(self):
         """
         Run the server until CTRL+C is pressed or the process exits.
         """
 
-        self.path_handler.prepare()
+        self.start()
+        print(f'Server is up at {self.host}:{self.port}. CTRL + C to close the server.')
 
-        request_handler = _ThreadedTCPRequestHandler
-        request_handler.path_handler = self.path_handler
+        try:
+            while True:
+                time.sleep(.5)
+        except KeyboardInterrupt:
+            print('Server shutting down...')
+            pass
 
-        with _ThreadedTCPServer((self.host, self.port), request_handler) as server:
-            # Start a thread with the server. Will spawn threads for each request thereafter.
-            server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        self.shutdown()
 
-            server_thread.start()
-            print(f'Server is up at {self.host}:{self.port}. CTRL + C to close the server.')
 
-            try:
-                while True:
-                    time.sleep(.5)
-            except KeyboardInterrupt:
-                print('Server shutting down...')
-                pass
+# ----
+class ThreadedWebServer(_WebServer):
+
+    def __init__(self, host='localhost', port=5000, idle_timeout=5.0):
+        """
+        Multithreaded webserver for demonstrative purposes. No safety guarantees whatsoever.
+        ----
+        host (str) : Host for the server
+        port (int) : Port for the server
+        idle_timeout (float) : Seconds a persistent (keep-alive) connection may stay idle before it is closed
+        """
+        
+        super().__init__(host, port, idle_timeout)
+
+        self._server = None
+
+    # ----
+    def _create_server(self, request_handler):
+        return _ThreadedTCPServer((self.host, self.port), request_handler)
+
+    # ----
+    def start(self):
+        """
+        Start serving in a background thread and return. Use shutdown() to stop.
+        """
+
+        self._prepare()
+
+        request_handler = type('_RequestHandler', (_ThreadedTCPRequestHandler,), {
+            'path_handler': self.path_handler,
+            'idle_timeout': self.idle_timeout,
+        })
+
+        self._server = self._create_server(request_handler)
+
+        # Port 0 picks a free port
+        self.port = self._server.server_address[1]
+
+        # Start a thread with the server. Will hand each connection to a thread thereafter.
+        server_thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        server_thread.start()
+
+    # ----
+    def shutdown(self):
+        """
+        Stop a server started with start().
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# ----
+class PooledWebServer(ThreadedWebServer):
+
+    def __init__(self, host='localhost', port=5000, idle_timeout=1.0, workers=8, queue_size=64):
+        """
+        Webserver with a fixed number of worker threads. Accepted connections wait for a free worker in a queue of
+        queue_size connections; once it is full, new connections get a prebuilt 503 response straight away instead
+        of another thread. A worker serves one connection at a time, including its idle keep-alive time, so keep
+        idle_timeout short. Use stats() to size workers and queue_size.
+        ----
+        host (str) : Host for the server
+        port (int) : Port for the server
+        idle_timeout (float) : Seconds a persistent (keep-alive) connection may stay idle before it is closed
+        workers (int) : Number of worker threads
+        queue_size (int) : Number of accepted connections that may wait for a worker
+        """
+
+        super().__init__(host, port, idle_timeout)
+
+        self.workers = workers
+        self.queue_size = queue_size
+
+    # ----
+    def _create_server(self, request_handler):
+        return _PooledTCPServer((self.host, self.port), request_handler, self.workers, self.queue_size)
+
+    # ----
+    def stats(self):
+        """
+        Returns (dict): Counters of the running server:
+                        workers, busy_workers : size of the pool and workers serving a connection
+                        queue_depth, queue_size : connections waiting for a worker and the most that may wait
+                        accepted, rejected : connections queued and connections answered with a 503
+                        handled : connections taken from the queue by a worker
+                        wait_avg, wait_max : seconds handled connections waited in the queue
+        """
+
+        if self._server is None:
+            raise Exception('PooledWebServer is not running')
+
+        return self._server.stats()
+
+
+# ----
+class AsyncWebServer(_WebServer):
+
+    def __init__(self, host='localhost', port=5000, idle_timeout=5.0, max_workers=16):
+        """
+        Single-threaded webserver on asyncio streams with the same paths as ThreadedWebServer. An open connection
+        costs a coroutine rather than a thread, so many idle keep-alive clients are cheap. Handlers declared with
+        async def run on the event loop; other handlers run on a pool of max_workers threads.
+        ----
+        host (str) : Host for the server
+        port (int) : Port for the server
+        idle_timeout (float) : Seconds a persistent (keep-alive) connection may stay idle before it is closed
+        max_workers (int) : Number of threads running handlers that are not coroutines
+        """
+
+        super().__init__(host, port, idle_timeout)
+        self.max_workers = max_workers
+
+        self._loop = None
+        self._stop = None
+        self._thread = None
+        self._connections = set()
+
+    # ----
+    async def _handle_connection(self, stream, writer, executor):
+        # Mirrors _ThreadedTCPRequestHandler.handle
+        reader = _AsyncRequestReader(stream, self.idle_timeout)
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+
+        try:
+            while True:
+                try:
+                    request = await _read_request_async(writer, reader)
+
+                except _HTTPError as ex:
+                    writer.write(ex.response)
+                    await writer.drain()
+                    return
+
+                if request is None:
+                    return
+
+                keep_alive, response = _keep_alive(request, await _route_async(self.path_handler, request, executor))
+                await _send_response_async(writer, response)
+
+                if not keep_alive:
+                    return
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            return
+
+        # Cancelled by serve() while shutting down; asyncio would log the cancellation of every open connection
+        except asyncio.CancelledError:
+            return
+
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    # ----
+    async def serve(self, started=None):
+        """
+        Coroutine serving until it is cancelled or shutdown() is called; use it to run the server on an existing
+        event loop.
+        ----
+        started (threading.Event) : Set once the server is listening
+        """
+
+        self._prepare()
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            server = await asyncio.start_server(lambda stream, writer: self._handle_connection(stream, writer, executor),
+                                                self.host, self.port, limit=_MAX_HEADER_SIZE)
+
+            # Port 0 picks a free port
+            self.port = server.sockets[0].getsockname()[1]
+
+            if started is not None:
+                started.set()
+
+            async with server:
+                await self._stop.wait()
+
+                # Keep-alive connections outlive the listening socket, and newer Pythons wait for them when leaving
+                # this block; stop accepting, then close them
+                server.close()
+                connections = list(self._connections)
+
+                for connection in connections:
+                    connection.cancel()
+
+                await asyncio.gather(*connections, return_exceptions=True)
+
+    # ----
+    def start(self):
+        """
+        Start serving on an event loop in a background thread and return. Use shutdown() to stop.
+        """
+
+        started = threading.Event()
+
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(started),), daemon=True)
+        self._thread.start()
+
+        while not started.wait(.1):
+            if not self._thread.is_alive():
+                self._thread = None
+                raise Exception(f'AsyncWebServer could not start on {self.host}:{self.port}')
+
+    # ----
+    def shutdown(self):
+        """
+        Stop a server started with start() or serve().
+        """
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._loop = None
 
-            server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
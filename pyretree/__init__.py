@@ -1 +1,5 @@
-from .helpers import RegexCollection
+from .helpers import RegexCollection, RegexOverlay, RegexMatch, Tokenizer, set_pattern_cache_size
+from .sharded import ShardedRegexCollection
+from .shared import SharedIndex
+from .dispatch import Dispatcher
+from .reload import IntentReloader
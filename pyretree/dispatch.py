@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class Dispatcher:
+
+    def __init__(self, collection, max_workers=4, max_pending=None, processes=False):
+        """
+        Runs the callbacks of matched expressions on a bounded pool so the matching thread never waits for them.
+        ---
+        collection (RegexCollection) : A prepared collection (or overlay) to resolve text with
+        max_workers (int) : Number of threads (or processes) running callbacks
+        max_pending (int) : Maximum number of callbacks queued or running at once; dispatch() blocks while the pool
+                            is this busy. Defaults to 4 * max_workers.
+        processes (bool) : Run callbacks in a process pool. Callbacks, their parameters and results must then be
+                           picklable (module-level functions).
+        """
+
+        self._collection = collection
+        self._executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending if max_pending is not None else 4 * max_workers)
+
+    # ----
+    def dispatch(self, text, extra_params=None, timeout=None):
+        """
+        Resolve text in the calling thread and run the matching callback on the pool.
+        ----
+        text (str) : String to parse with the collection
+        extra_params (dict) : Extra parameters to be passed to the called function
+        timeout (float) : Seconds to wait for a free slot when max_pending callbacks are outstanding; None waits forever
+        --
+        Returns (concurrent.futures.Future | None): Future of the callback result, or None if nothing matched
+        """
+
+        resolved = self._collection.resolve(text, extra_params)
+
+        if resolved is None:
+            return None
+
+        return self.submit(resolved, timeout)
+
+    # ----
+    def submit(self, resolved, timeout=None):
+        """
+        Run an already resolved match on the pool.
+        ----
+        resolved (RegexMatch) : Result of RegexCollection.resolve() or match_all()
+        timeout (float) : See dispatch()
+        --
+        Returns (concurrent.futures.Future): Future of the callback result
+        """
+
+        if not self._slots.acquire(timeout=timeout):
+            raise Exception(f'Dispatcher is still busy after {timeout} seconds')
+
+        try:
+            future = self._executor.submit(resolved.callback, **resolved.kwargs)
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        return future
+
+    # ----
+    def shutdown(self, wait=True):
+        """
+        Stop accepting callbacks; if wait is True, block until running ones have finished.
+        """
+
+        self._executor.shutdown(wait=wait)
+
+    # ----
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.shutdown()
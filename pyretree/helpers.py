@@ -1,5 +1,15 @@
 import re
+import heapq
+import inspect
+import bisect
+import collections
+import datetime
+import itertools
 import pprint
+import sys
+import threading
+import unicodedata
+import weakref
 from operator import itemgetter
 
 # --- Logging configuration
@@ -8,23 +18,210 @@ pyretree_logger = logging.getLogger(__name__)
 pyretree_logger.addHandler(logging.NullHandler())
 # ---
 
+# Characters which can never appear in a plain-text token; tree keys containing them are unreachable
+_NON_LITERAL_CHARS = frozenset('()[]{}|?*+\\^$<>')
+
+def _to_time(text):
+    return datetime.time(*(int(part) for part in text.split(':')))
+
+# Types of <name:type> variables: pattern they compile to, converter applied to the extracted value. Variables
+# whose type cannot span a separator are tree edges, tested narrowest first (in this order).
+_VARIABLE_TYPES = {
+    'int': (r'[+-]?\d+', int),
+    'float': (r'[+-]?(?:\d+\.?\d*|\.\d+)', float),
+    'date': (r'\d{4}-\d{2}-\d{2}', datetime.date.fromisoformat),
+    'time': (r'\d{1,2}:\d{2}(?::\d{2})?', _to_time),
+    'word': (r'\w+', None),
+    'slug': (r'[-\w]+', None),
+}
+
+_PLACEHOLDER_PARSER = re.compile('<(.*?)(=(.*?))?>', flags=re.IGNORECASE)
+_TYPED_VARIABLE = re.compile(r'<\w+:(\w+)>')
+_GROUP_NAME = re.compile(r'\(\?P<\w+>')
+
+# Tree key of each type's edge -> test of whether an item fits the type
+_TYPED_EDGE_TESTS = {f'<{type_name}>': re.compile(pattern).fullmatch for type_name, (pattern, _) in _VARIABLE_TYPES.items()}
+
+
+class _PatternCache:
+
+    def __init__(self, max_size=4096):
+        """
+        Process-wide cache of compiled expressions shared by all collections. Patterns in use by any collection are
+        found through weak references however many there are; the max_size most recently requested are also kept
+        alive after every collection using them is gone.
+        """
+
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._patterns = weakref.WeakValueDictionary()
+        self._recent = collections.OrderedDict()
+
+    # ----
+    def get(self, key, compile_pattern):
+        """
+        key (tuple) : (expression, flags, raw)
+        compile_pattern (callable) : Called with *key to compile the pattern when it is not cached
+        """
+
+        with self._lock:
+            pattern = self._patterns.get(key)
+
+        if pattern is None:
+            pattern = compile_pattern(*key)
+
+            with self._lock:
+                pattern = self._patterns.setdefault(key, pattern)
+
+        with self._lock:
+            self._recent[key] = pattern
+            self._recent.move_to_end(key)
+
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+
+        return pattern
+
+    # ----
+    def clear(self):
+        with self._lock:
+            self._patterns.clear()
+            self._recent.clear()
+
+_pattern_cache = _PatternCache()
+
+def set_pattern_cache_size(max_size):
+    """
+    Set how many recently used compiled expressions are kept alive by the process-wide pattern cache once no
+    RegexCollection uses them anymore (default 4096). Patterns still in use are always shared.
+    """
+
+    with _pattern_cache._lock:
+        _pattern_cache.max_size = max_size
+
+        while len(_pattern_cache._recent) > max_size:
+            _pattern_cache._recent.popitem(last=False)
+
+
+class Tokenizer:
+
+    def __init__(self, separator=' ', pattern=None, collapse=False, casefold=False, normalize=None):
+        """
+        Splits text into the items a RegexCollection's tree is keyed by. The same tokenizer splits expressions when
+        the tree is built and text when matching, so both always agree.
+        ---
+        separator (str) : The character(s) items are separated by; items are always rejoined with it
+        pattern (str) : Regular expression items are separated by instead of separator (e.g. '[ ,;]+'); must not
+                        contain capturing groups
+        collapse (bool) : Drop empty items, so repeated, leading and trailing separators are ignored
+        casefold (bool) : Key the tree by casefolded items, so lookups are case-insensitive like the regexps
+        normalize (str) : Unicode normalization form ('NFC', 'NFKC', ...) applied to expressions and text
+        """
+
+        self.separator = separator
+        self.pattern = pattern
+        self.collapse = collapse
+        self.casefold = casefold
+        self.normalize = normalize
+
+        self._compiled_pattern = re.compile(pattern) if pattern is not None else None
+
+        # Items must be rejoined for the regexps when splitting does more than str.split
+        self._rejoin = pattern is not None or collapse
+        self._plain = not (self._rejoin or casefold or normalize)
+
+    # ----
+    def tokenize(self, text):
+        """
+        Returns (tuple): (list) items, (list) tree keys of the items, (str) normalized text for the regexps to match
+        """
+
+        if self._plain:
+            items = text.split(self.separator)
+            return items, items, text
+
+        if self.normalize is not None:
+            text = unicodedata.normalize(self.normalize, text)
+
+        if self._compiled_pattern is not None:
+            items = self._compiled_pattern.split(text)
+        else:
+            items = text.split(self.separator)
+
+        if self.collapse:
+            items = [item for item in items if item] or ['']
+
+        if self._rejoin:
+            text = self.separator.join(items)
+
+        keys = [item.casefold() for item in items] if self.casefold else items
+
+        return items, keys, text
+
+    # ----
+    def normalize_expression(self, expression):
+        # Expressions hold the regexps matched against normalized text, so they are normalized alike
+        if self.normalize is None:
+            return expression
+
+        return unicodedata.normalize(self.normalize, expression)
+
+    # ----
+    def __eq__(self, other):
+        return (isinstance(other, Tokenizer) and
+                (self.separator, self.pattern, self.collapse, self.casefold, self.normalize) ==
+                (other.separator, other.pattern, other.collapse, other.casefold, other.normalize))
+
+    def __hash__(self):
+        return hash((self.separator, self.pattern, self.collapse, self.casefold, self.normalize))
+
+    def __repr__(self):
+        return (f'Tokenizer(separator={self.separator!r}, pattern={self.pattern!r}, collapse={self.collapse}, '
+                f'casefold={self.casefold}, normalize={self.normalize!r})')
+
 
 class _RegexTree:
 
-    def __init__(self, separator=' ', preserve_regexps=False, max_depth=None):
+    def __init__(self, separator=' ', preserve_regexps=False, max_depth=None, max_edit_distance=0, max_fuzzy_paths=16,
+                 tokenizer=None):
         self._raw_regexps = []
         self._tree = {}
 
-        self._separator = separator
+        self._tokenizer = tokenizer if tokenizer is not None else Tokenizer(separator)
+        self._separator = self._tokenizer.separator
         self._preserve_regexps = preserve_regexps
         self._max_depth = max_depth
+        self._max_edit_distance = max_edit_distance
+        self._max_fuzzy_paths = max_fuzzy_paths
         self._built = False
 
         self._pending_count = 0
         self._regex_count = 0
 
+        # callback -> names it accepts as keyword arguments (None if it takes **kwargs)
+        self._callback_params = {}
+
+        # id(node) -> (node, derived data); filled lazily by complete() and approximate matching
+        self._sorted_keys = {}
+        self._token_indexes = {}
+
+        # id(bucket) -> (bucket, {item position: item index}); filled lazily by complete()
+        self._bucket_indexes = {}
+
+        # id(node) -> (node, {<VAR> mask: merged candidates}); filled by prepare(), see _descend()
+        self._merged_candidates = {}
+
+        # expression -> {variable name: converter} for expressions with typed variables
+        self._converters = {}
+
+        # Types whose items can be told apart in the tree; see _locate()
+        self._edge_types = frozenset() if self._tokenizer.pattern is not None else frozenset(
+            type_name for type_name, (pattern, _) in _VARIABLE_TYPES.items() if not re.search(pattern, self._separator))
+        self._typed_edges = False
+
         self._regex_flags = re.IGNORECASE
-        self._build_parser_main = re.compile('<(.*?)(=(.*?))?>', flags=self._regex_flags)
+        self._build_parser_main = _PLACEHOLDER_PARSER
         self._build_parser_fill_novalue = re.compile(r'>\)', flags=self._regex_flags)
 
     # ----
@@ -33,9 +230,17 @@ class _RegexTree:
             return False
 
         self._built = False
+        expression = self._tokenizer.normalize_expression(expression)
         self._raw_regexps.append((expression, self._build_regex(expression), callback))
         self._pending_count += 1
 
+        if callback not in self._callback_params:
+            self._callback_params[callback] = _accepted_params(callback)
+
+        converters = _placeholder_converters(expression)
+        if converters:
+            self._converters[expression] = converters
+
         return True
 
     # ----
@@ -43,6 +248,15 @@ class _RegexTree:
         if self._built:
             return False
 
+        # Fail now rather than on the first matching text
+        for expression, regex, callback in self._raw_regexps:
+            accepted = self._callback_params.get(callback)
+            rejected = [name for name in regex.groupindex if accepted is not None and name not in accepted]
+
+            if rejected:
+                raise Exception(f'Callback {getattr(callback, "__name__", callback)} does not accept '
+                                f'{", ".join(rejected)} extracted by expression "{expression}"')
+
         if self._max_depth is None:
             self._max_depth = max(1, self._regex_count // 5)
 
@@ -55,6 +269,9 @@ class _RegexTree:
         if self._preserve_regexps:
             self._regex_count = 0
 
+            # Rebuilt from scratch; branches may be shared with other trees (see merge)
+            self._tree = {}
+
             for regex in reversed(self._raw_regexps):
                 self._add_to_tree(regex)
                 self._regex_count  += 1
@@ -65,218 +282,1823 @@ class _RegexTree:
                 self._regex_count  += 1
                 self._pending_count -= 1
 
+        self._sorted_keys = {}
+        self._token_indexes = {}
+        self._bucket_indexes = {}
+        self._merged_candidates = {}
+
+        self._precompute_candidates(self._tree)
+
+        if self._max_edit_distance > 0:
+            self._get_token_index(self._tree)
+
         self._built = True
 
         return True
 
     # ----
     def _build_regex(self, expression, raw=False):
+        # Collections commonly share expressions; compile each one once per process
+        return _pattern_cache.get((expression, self._regex_flags, raw), self._compile_regex)
+
+    # ----
+    def _compile_regex(self, expression, flags, raw):
         if raw:
-            return re.compile(expression, flags=self._regex_flags)
+            return re.compile(expression, flags=flags)
 
         # Replace name/value shorthand with proper regex syntax
-        parsed = self._build_parser_main.sub(r'(?P<\1>\3)', expression)
+        parsed = self._build_parser_main.sub(_expand_placeholder, expression)
         parsed = self._build_parser_fill_novalue.sub(r'>.*?)', parsed)
 
-        return re.compile(f'^{parsed}$', flags=self._regex_flags)
+        return re.compile(f'^{parsed}$', flags=flags)
 
     # ----  
-    def _add_to_tree(self, regex):
+    def _add_to_tree(self, regex, root=None, copied=None):
         expression, regex, callback = regex
 
-        current_node = self._tree
-        expression_parts = expression.split(self._separator)
+        current_node = self._locate(expression, self._tree if root is None else root, copied)
+
+        # Expressions without variables (entirely constants) are always checked first (lowest weight)
+        if not '<' in expression:
+            expression_weight = 9999999
+        else:
+            expression_weight = len(expression)
+
+        current_node.append((expression_weight, regex, callback, expression))
+        current_node.sort(key=itemgetter(0), reverse=True)
+
+    # ----
+    def _locate(self, expression, root, copied=None):
+        """
+        Finds the regex list an expression belongs in, creating branches as needed.
+        copied (set) : If given, nodes on the way whose ids are not in copied are copied before they are changed, so
+                       other versions of the tree sharing them are unaffected (root itself must already be a copy)
+        --
+        Returns (list): The regex list
+        """
+
+        current_node = root
+        expression_parts = self._split(expression)
+
+        # Expressions starting with a variable are indexed from their last item instead, in the suffix index kept
+        # under the root's <VAR> key
+        if _is_variable(expression_parts[0]) and self._typed_key(expression_parts[0]) is None:
+            if '<VAR>' not in root:
+                root['<VAR>'] = {}
+
+            current_node = self._own(root, '<VAR>', copied)
+            expression_parts = expression_parts[::-1]
+
         max_depth = min(self._max_depth, len(expression_parts))
 
         # Iterate through the expression and build the branches
         for part_pos in range(max_depth):
             part = expression_parts[part_pos]
+            typed_key = self._typed_key(part)
+
+            # Typed variables spanning exactly one item are edges like constants, keyed by their type
+            if typed_key is not None:
+                part = typed_key
+                self._typed_edges = True
 
             if len(part) == 0:
                 current_node[''] = current_node[''] if '' in current_node else []
 
             # Hit a variable (<...>)
-            elif part[0] == '<' and part[-1] == '>':
+            elif _is_variable(part) and typed_key is None:
                 # Create an regex list if one does not exist
                 current_node['<VAR>'] = current_node['<VAR>'] if '<VAR>' in current_node else []
-                current_node = current_node['<VAR>']
+                current_node = self._own(current_node, '<VAR>', copied)
                 break
 
             # Hit a constant (plain text)
             else:
                 if not current_node.get(part, False):
-                    # Deepest node is a list
-                    if part_pos == (max_depth - 1):
+                    # Nodes at the depth of the tree are lists; shorter expressions end in an <END> list instead,
+                    # so longer ones can still branch below the same node
+                    if part_pos == (self._max_depth - 1):
                         current_node[part] = []
 
                     # All other nodes are dicts
                     else:
                         current_node[part] = {}
 
-            current_node = current_node[part]
+            current_node = self._own(current_node, part, copied)
 
         # Reached end of expression without encountering a variable
         if type(current_node) == dict:
             current_node['<END>'] = current_node['<END>'] if '<END>' in current_node else []
-            current_node = current_node['<END>']
-
-        # Expressions without variables (entirely constants) are always checked first (lowest weight)
-        if not '<' in expression:
-            expression_weight = 9999999
-        else:
-            expression_weight = len(expression)
+            current_node = self._own(current_node, '<END>', copied)
 
-        current_node.append((expression_weight, regex, callback))
-        current_node.sort(key=itemgetter(0), reverse=True)
+        return current_node
 
     # ----
-    def match(self, text, extra_params=None):
+    def _typed_key(self, part):
         """
-        Calls the most applicable regex's callback.
-        extra_params (dict) : Extra data to be passed to the called function
-        --
-        Returns (tuple): (bool) found match, callback result
+        Returns (str | None): Tree key of a <name:type> variable whose type never spans a separator, else None
         """
 
-        extra_params = {} if extra_params is None else extra_params
+        typed = _TYPED_VARIABLE.fullmatch(part)
 
-        if not self._built:
+        if typed is None or typed.group(1) not in self._edge_types:
             return None
 
-        separated = text.split(self._separator)
-        first, all_but_first = separated[0], separated[1:]
+        return f'<{typed.group(1)}>'
 
-        current_node = self._tree.get(first, False)
+    # ----
+    def _children(self, node, word):
+        # Children of node along word: its literal edge, then every typed edge fitting word, narrowest type first
+        child = node.get(word)
+        children = [] if child is None else [child]
 
-        # Text is not in regex tree
-        if not current_node:
-            return False, False
+        if self._typed_edges:
+            children += [node[key] for key, test in _TYPED_EDGE_TESTS.items() if key in node and test(word)]
+
+        return children
+
+    # ----
+    def _own(self, node, key, copied):
+        child = node[key]
+
+        if copied is not None and id(child) not in copied:
+            self._forget(child)
+            child = node[key] = child.copy()
+            copied.add(id(child))
+
+        return child
+
+    # ----
+    def _forget(self, node):
+        # Drops what the caches derived from a node that is being replaced
+        for cache in (self._sorted_keys, self._token_indexes, self._bucket_indexes, self._merged_candidates):
+            cached = cache.get(id(node))
+
+            if cached is not None and cached[0] is node:
+                del cache[id(node)]
+
+    # ----
+    def _apply_changes(self, added, removed):
+        """
+        Adds and removes regexps without rebuilding. Only the first-level branches the regexps belong in are copied,
+        changed and precomputed; see _install(). Cost follows the size of those branches, not of the tree.
+        added (list) : (expression, compiled regex, callback) to add
+        removed (list) : Entries (as stored in the tree) to remove
+        """
+
+        root = self._stage([regex[0] for regex in added] + [entry[3] for entry in removed])
+        copied = set(id(node) for node in (root, root.get('<VAR>')) if node is not None)
+
+        for entry in removed:
+            bucket = self._locate(entry[3], root, copied)
+
+            for entry_pos, other in enumerate(bucket):
+                if other is entry:
+                    del bucket[entry_pos]
+                    break
+
+        for regex in added:
+            if regex[2] not in self._callback_params:
+                self._callback_params[regex[2]] = _accepted_params(regex[2])
+
+            converters = _placeholder_converters(regex[0])
+            if converters:
+                self._converters[regex[0]] = converters
+
+            self._add_to_tree(regex, root, copied)
+
+        if self._preserve_regexps:
+            if removed:
+                removed_keys = set((entry[3], id(entry[2])) for entry in removed)
+                self._raw_regexps = [regex for regex in self._raw_regexps if (regex[0], id(regex[2])) not in removed_keys]
 
-        if len(first) > 2 and first[0] == '<' and first[-1] == '>':
-            raise Exception('First item in regex cannot be a variable')
+            self._raw_regexps += added
 
-        # Traverse tree to find applicable regexps
-        iter_boundry = min(len(all_but_first), self._max_depth)
-        possible = []
+        # Deeper nodes emptied by the removals are dropped, as a fresh build would not have them
+        for node in (root, root.get('<VAR>', {})):
+            for key, branch in node.items():
+                if type(branch) is dict and id(branch) in copied and not (node is root and key == '<VAR>'):
+                    self._prune(branch, copied)
 
-        for word_pos in range(iter_boundry):
-            word = all_but_first[word_pos]
+        self._install(root)
+        self._regex_count += len(added) - len(removed)
 
-            # TODO :: Does this limit functionality?
-            if word in current_node:
-                current_node = current_node[word]
+    # ----
+    def _prune(self, node, copied):
+        # Removes the empty children of a copied node, recursing into its copied subtrees
+        for key, child in list(node.items()):
+            if id(child) not in copied:
                 continue
 
-            if '<VAR>' in current_node:
-                possible += current_node['<VAR>']
+            if type(child) is dict:
+                self._prune(child, copied)
 
-        if '<END>' in current_node:
-            possible += current_node['<END>']
+            if not child:
+                del node[key]
 
-        elif type(current_node) is list:
-            possible += current_node
+    # ----
+    def _stage(self, expressions):
+        """
+        Returns (dict): A root holding only the first-level branches that expressions belong in (those of the suffix
+                        index under <VAR>), for _locate() to copy and change before _install() swaps them in
+        """
 
-        for _, regex, callback in possible:
-            extracted = regex.match(text)
+        staged = {}
+        suffix_index = self._tree.get('<VAR>', {})
 
-            if extracted:
-                return True, callback(**extracted.groupdict(), **extra_params)
+        for expression in expressions:
+            expression_parts = self._split(expression)
+
+            # As placed by _locate()
+            if _is_variable(expression_parts[0]) and self._typed_key(expression_parts[0]) is None:
+                node, branches, part = suffix_index, staged.setdefault('<VAR>', {}), expression_parts[-1]
+            else:
+                node, branches, part = self._tree, staged, expression_parts[0]
+
+            key = self._typed_key(part)
+            if key is None:
+                key = '<VAR>' if _is_variable(part) else part
 
-        return False, False
+            if key in node:
+                branches[key] = node[key]
+
+        return staged
 
     # ----
-    def __str__(self):
-        if self._built:
-            return f'<RegexTree (built) with {self._regex_count} regexps>'
-        else:
-            return f'<RegexTree (unbuilt) with {self._pending_count} queued regexps>'
+    def _install(self, staged):
+        """
+        Swaps the first-level branches of a staged root into the tree, each with a single assignment, so a concurrent
+        match sees either the old or the new version of a branch. Only the swapped branches are precomputed again.
+        """
 
-    def __repr__(self):
-        if self._built:
-            return pprint.pformat(self._tree)
+        targets = [(self._tree, staged)]
+        staged_suffix_index = staged.pop('<VAR>', None)
 
-        else:
-            notice = '\n==\nNOTICE: Displaying queued regexps\n==\n' 
-            return f'{notice}{pprint.pformat(self._raw_regexps)}{notice}'
+        if staged_suffix_index:
+            if '<VAR>' not in self._tree:
+                self._tree['<VAR>'] = {}
 
-# ----
-class RegexCollection:
-    def __init__(self, separator=' ', preserve_regexps=False):
+            targets.append((self._tree['<VAR>'], staged_suffix_index))
+
+        for node, branches in targets:
+            new_keys = [key for key in branches if key not in node]
+
+            for key, branch in branches.items():
+                if node.get(key) is branch:
+                    continue
+
+                node[key] = branch
+
+                if key not in ('<VAR>', '<END>'):
+                    self._precompute_candidates(branch, 0)
+
+            # The node itself was changed in place; keep the key caches built from it up to date
+            cached = self._sorted_keys.get(id(node))
+            if cached is not None and cached[0] is node:
+                for key in new_keys:
+                    if key not in ('<VAR>', '<END>'):
+                        bisect.insort(cached[1], key)
+
+            cached = self._token_indexes.get(id(node))
+            if cached is not None and cached[0] is node:
+                cached[1].add(key for key in new_keys if not _NON_LITERAL_CHARS.intersection(key))
+
+        if self._max_edit_distance > 0:
+            self._get_token_index(self._tree)
+
+    # ----
+    def merge(self, other, on_conflict='error'):
         """
-        Stores regexp-like strings containing `separator` in an optimal way to minimize time to match against any number of regexps.
-        Use an instance of RegexCollection to decorate functions using RegexpCollection.add
-        ---
-        separator (str) : The character(s) by which the stored strings will be split
-        preserve_regexps (bool) : Whether or not to preserve added expressions after RegexCollection.prepare() is called. This allows
-                                  for addition of more expressions after prepare() is called at the cost of some memory.
+        Grafts the entries of another built tree into this one. Branches only one tree has are shared, not copied,
+        and compiled regexps are reused. Only the first-level branches of other are visited, merged and precomputed,
+        and each is swapped in with a single assignment; see _install().
+        on_conflict (str) : See RegexCollection.merge
         """
 
-        self._regex_tree = _RegexTree(separator=separator, preserve_regexps=preserve_regexps)
-        self._prev_function = None
+        if on_conflict not in ('error', 'keep', 'replace', 'both'):
+            raise Exception(f'Unknown on_conflict "{on_conflict}"; expected error, keep, replace or both')
+
+        if not self._built or not other._built:
+            raise Exception('RegexCollections must be prepared before they can be merged')
+
+        if len(other._layers()) > 1:
+            raise Exception('RegexOverlay cannot be merged into another collection')
+
+        if other._tokenizer != self._tokenizer or other._max_depth != self._max_depth:
+            raise Exception('Only RegexCollections with the same tokenizer and tree depth can be merged')
+
+        dropped = []
+        staged = {}
+
+        for key, branch in other._tree.items():
+            # The root's <VAR> key holds the suffix index, whose branches are merged one by one like the root's
+            if key == '<VAR>' and type(branch) is dict:
+                suffix_index = self._tree.get('<VAR>', {})
+                staged['<VAR>'] = {suffix_key: suffix_branch if suffix_key not in suffix_index else
+                                   self._merge_nodes(suffix_index[suffix_key], suffix_branch, on_conflict, dropped)
+                                   for suffix_key, suffix_branch in branch.items()}
+
+            elif key in self._tree:
+                staged[key] = self._merge_nodes(self._tree[key], branch, on_conflict, dropped)
+
+            else:
+                staged[key] = branch
+
+        self._callback_params.update(other._callback_params)
+        self._converters.update(other._converters)
+        self._typed_edges = self._typed_edges or other._typed_edges
+
+        if self._preserve_regexps:
+            theirs = list(other._entries())
+            theirs_ids = set(id(entry) for entry in theirs)
+            dropped_ids = set(id(entry) for entry in dropped)
+            dropped_mine = set((entry[3], id(entry[2])) for entry in dropped if id(entry) not in theirs_ids)
+
+            if dropped_mine:
+                self._raw_regexps = [regex for regex in self._raw_regexps if (regex[0], id(regex[2])) not in dropped_mine]
+
+            self._raw_regexps += [(entry[3], entry[1], entry[2]) for entry in theirs if id(entry) not in dropped_ids]
+
+        self._install(staged)
+        self._regex_count += other._regex_count - len(dropped)
 
     # ----
-    def add(self, expression, raw=False):
+    def _merge_nodes(self, mine, theirs, on_conflict, dropped):
         """
-        Decorator : Add an expression to the collection and bind it to the decorated function
-        ----
-        expression (str) : A regexp-like string to match against. Use <some_var> and <some_var=foo> to extract values from the matching text.
-        raw (bool) : Whether or not to interpret the expression as a raw regexp (skip reformatting from simpler format)
+        Returns (dict | list): A new node holding the entries of both nodes; children only one of them has are shared
         """
 
-        def regex_adder(callback, *args, **kwargs):
-            # Cache previous function to resolve issue with stacked decorators
-            if callback is None:
-                callback = self._prev_function
-            self._prev_function = callback
+        # mine is replaced by the merged node
+        self._forget(mine)
 
-            if not self._regex_tree.add(expression, callback):
-                raise Exception('Cannot add to prepared RegexCollection when preserve_regs is False')
+        if type(mine) is list and type(theirs) is list:
+            return self._merge_buckets(mine, theirs, on_conflict, dropped)
 
-        return regex_adder
+        if type(mine) is not dict or type(theirs) is not dict:
+            raise Exception('Trees of different shapes cannot be merged; prepare both with the same max_depth')
+
+        # Only the children of the smaller node are visited
+        if len(theirs) > len(mine):
+            merged, smaller, smaller_is_theirs = theirs.copy(), mine, False
+        else:
+            merged, smaller, smaller_is_theirs = mine.copy(), theirs, True
+
+        for key, child in smaller.items():
+            other_child = merged.get(key)
+
+            if other_child is None:
+                merged[key] = child
+
+            elif smaller_is_theirs:
+                merged[key] = self._merge_nodes(other_child, child, on_conflict, dropped)
+
+            else:
+                merged[key] = self._merge_nodes(child, other_child, on_conflict, dropped)
+
+        return merged
+
+    # ----
+    def _merge_buckets(self, mine, theirs, on_conflict, dropped):
+        # Entries both buckets hold (same expression and callback) are kept once
+        mine_keys = set((entry[3], id(entry[2])) for entry in mine)
+        duplicates = [entry for entry in theirs if (entry[3], id(entry[2])) in mine_keys]
+
+        if duplicates:
+            dropped += duplicates
+            theirs = [entry for entry in theirs if (entry[3], id(entry[2])) not in mine_keys]
+
+        if on_conflict != 'both':
+            theirs_expressions = set(entry[3] for entry in theirs)
+            conflicts = [entry for entry in mine if entry[3] in theirs_expressions]
+
+            if conflicts and on_conflict == 'error':
+                raise Exception(f'Expression "{conflicts[0][3]}" is bound to different callbacks in the merged collections')
+
+            if conflicts and on_conflict == 'keep':
+                conflicting = set(entry[3] for entry in conflicts)
+                dropped += [entry for entry in theirs if entry[3] in conflicting]
+                theirs = [entry for entry in theirs if entry[3] not in conflicting]
+
+            elif conflicts:
+                dropped += conflicts
+                mine = [entry for entry in mine if entry[3] not in theirs_expressions]
+
+        # Equal weights keep this tree's entries first, as if theirs had been added later
+        return list(heapq.merge(mine, theirs, key=itemgetter(0), reverse=True))
+
+    # ----
+    def _entries(self):
+        # Every regex entry stored in the tree
+        for _, bucket, _ in self._iter_buckets():
+            yield from bucket
 
     # ----
     def match(self, text, extra_params=None):
         """
         Calls the most applicable regex's callback.
-        ----
-        text (str) : String to parse with the collection
-        extra_params (dict) : Extra parameters to be passed to the called function
+        extra_params (dict) : Extra data to be passed to the called function
         --
         Returns (tuple): (bool) found match, callback result
         """
 
-        result = self._regex_tree.match(text, extra_params)
+        if not self._built:
+            return None
 
-        if result is None:
-            raise Exception('RegexCollection must be prepared before matching')
+        resolved = self.resolve(text, extra_params)
 
-        return result
+        if resolved is None:
+            return False, False
+
+        return True, resolved()
 
     # ----
-    def prepare(self):
+    def resolve(self, text, extra_params=None):
         """
-        Build the collection after expressions have been added to it. Must be called before
-        RegexCollection.match() may be used.
+        Finds the most applicable regex without calling its callback.
+        extra_params (dict) : Extra data to be passed to the callback
+        --
+        Returns (RegexMatch | None): The match, or None if no regex matched
         """
 
-        if not self._regex_tree.build_tree():
-            pyretree_logger.debug('RegexCollection was already prepared\n')
+        extra_params = {} if extra_params is None else extra_params
 
-    # --------
-    def __str__(self):
-        if self._regex_tree._built:
-            return f'<RegexCollection (built) with {self._regex_tree._regex_count} regexps>'
-        else:
-            return f'<RegexCollection (unbuilt) with {self._regex_tree._pending_count} unprepared regexps'
+        items, keys, text = self._tokenizer.tokenize(text)
+        resolved = next(self._matches(text, self._candidates(keys), extra_params), None)
 
-    def __repr__(self):
-        if self._regex_tree._built:
-            return pprint.pformat(self._regex_tree._tree)
+        # Retry along edges whose keys are within the edit distance of the text's items
+        if resolved is None and self._max_edit_distance > 0:
+            for cost, possible, corrected in self._fuzzy_candidates(keys, items):
+                resolved = next(self._matches(self._separator.join(corrected), possible, extra_params), None)
 
-        else:
-            notice = '\n==\nNOTICE: Displaying unprepared regexps\n==\n' 
-            return f'{notice}{pprint.pformat(self._regex_tree._raw_regexps)}{notice}'
+                if resolved is not None:
+                    pyretree_logger.debug(f'Approximate match for "{text}" at edit distance {cost}\n')
+                    break
+
+        return resolved
 
     # ----
-    def __len__(self):
-        return self._regex_tree._regex_count if self._regex_tree._regex_count else self._regex_tree._pending_count
+    def match_all(self, text, extra_params=None):
+        """
+        Lazily yields every regex matching text, in the order match() tries them. Never calls callbacks.
+        extra_params (dict) : Extra data to be passed to the callbacks
+        --
+        Yields (RegexMatch)
+        """
+
+        extra_params = {} if extra_params is None else extra_params
+
+        _, keys, text = self._tokenizer.tokenize(text)
+
+        # Candidates hold every regex once
+        yield from self._matches(text, self._candidates(keys), extra_params)
+
+    # ----
+    def _matches(self, text, possible, extra_params):
+        """
+        Yields (RegexMatch): For each regex in possible matching text, in order
+        """
+
+        # Text is not in regex tree
+        if possible is None:
+            return
+
+        for _, regex, callback, expression in possible:
+            extracted = regex.match(text)
+
+            if extracted:
+                kwargs = extracted.groupdict()
+                converters = self._converters.get(expression)
+
+                if converters is not None:
+                    try:
+                        for name, converter in converters.items():
+                            if kwargs[name] is not None:
+                                kwargs[name] = converter(kwargs[name])
+
+                    # Fits the pattern but not the type, such as 25:00 for a time
+                    except ValueError:
+                        continue
+
+                kwargs.update(_bind_params(self._callback_params.get(callback), extra_params))
+
+                yield RegexMatch(callback, kwargs, expression)
+
+    # ----
+    def _candidates(self, separated):
+        """
+        Traverses the tree along the tree keys of the text's items, and the suffix index backwards along them.
+        --
+        Returns (list): Applicable regex entries in the order they should be tried, or None if neither the
+                        first item of the text is in the tree nor its last item in the suffix index
+        """
+
+        possible = self._descend_each(self._root_children(separated[0]), separated[1:self._max_depth + 1])
+
+        if '<VAR>' in self._tree:
+            possible = _merge_candidates((possible, self._suffix_candidates(separated)))
+
+        return possible
+
+    # ----
+    def _root_children(self, word):
+        # The <VAR> key of the root holds the suffix index, which is never reached from the front
+        if word == '<VAR>':
+            return []
+
+        return self._children(self._tree, word)
+
+    # ----
+    def _suffix_candidates(self, separated):
+        """
+        Returns (list): Applicable regex entries of expressions starting with a variable, or None if the last item
+                        of the text is not in the suffix index
+        """
+
+        suffix_index = self._tree.get('<VAR>', {})
+
+        return self._descend_each(self._children(suffix_index, separated[-1]), separated[-2:-self._max_depth - 2:-1])
+
+    # ----
+    def _descend_each(self, nodes, words):
+        """
+        Returns (list | tuple): The candidates of _descend() from each of nodes merged by weight, or None if there
+                                are none of nodes
+        """
+
+        nodes = [node for node in nodes if node]
+
+        if not nodes:
+            return None
+
+        if len(nodes) == 1:
+            return self._descend(nodes[0], words)
+
+        # The first word fits several edges, such as a literal and a typed one
+        return _merge_sorted([entry for node in nodes for entry in self._descend(node, words)])
+
+    # ----
+    def _descend(self, current_node, words):
+        """
+        Traverses the tree below a first-level node. The candidates only depend on the node reached and on which
+        nodes along the way had their <VAR> regexps collected (bit n of var_mask for the node n steps below the
+        first), so they are looked up rather than collected.
+        --
+        Returns (list | tuple): Applicable regex entries, highest weight first
+        """
+
+        start_node = current_node
+        var_mask = 0
+        node_depth = 0
+
+        for word in words:
+            # Leaves hold regexps, not words
+            if type(current_node) is list:
+                break
+
+            children = self._children(current_node, word)
+
+            # Only typed edges make a word fit several edges; such paths are not precomputed
+            if len(children) > 1:
+                return self._branch_candidates(start_node, words)
+
+            if children:
+                current_node = children[0]
+                node_depth += 1
+
+            elif '<VAR>' in current_node:
+                var_mask |= 1 << node_depth
+
+        if type(current_node) is list:
+            bucket = current_node
+        else:
+            bucket = current_node.get('<END>', ())
+
+        # Buckets are kept sorted, so without <VAR> regexps there is nothing to merge
+        if not var_mask:
+            return bucket
+
+        cached = self._merged_candidates.get(id(current_node))
+
+        if cached is None or cached[0] is not current_node:
+            cached = self._merged_candidates[id(current_node)] = (current_node, {})
+
+        merged = cached[1].get(var_mask)
+
+        if merged is None:
+            # Not precomputed; collect the candidates the slow way
+            possible = []
+
+            for word in words:
+                if type(start_node) is list:
+                    break
+
+                (start_node, possible), = self._steps(start_node, word, possible)
+
+            merged = cached[1][var_mask] = _merge_sorted(possible + list(bucket))
+
+        return merged
+
+    # ----
+    def _branch_candidates(self, current_node, words):
+        """
+        Collects the candidates of every path below a first-level node along words, following each edge a word fits.
+        --
+        Returns (tuple): Applicable regex entries, highest weight first
+        """
+
+        states = [(current_node, [])]
+
+        for word in words:
+            states = [step for node, possible in states
+                      for step in ([(node, possible)] if type(node) is list else self._steps(node, word, possible))]
+
+        return _merge_sorted([entry for node, possible in states for entry in self._finish(node, list(possible))])
+
+    # ----
+    def _precompute_candidates(self, node, depth=-1, var_lists=()):
+        """
+        Merges the candidates of every traversal state of _descend() which collects <VAR> regexps.
+        depth (int) : Steps node is below a first-level node (-1 for the root and the suffix index)
+        var_lists (tuple) : (bit, <VAR> list) of the nodes above node which have <VAR> regexps
+        """
+
+        if depth < 0:
+            for key, child in node.items():
+                # The root's <VAR> key holds the suffix index
+                if key == '<VAR>' and type(child) is dict:
+                    self._precompute_candidates(child)
+
+                elif key not in ('<VAR>', '<END>'):
+                    self._precompute_candidates(child, 0)
+
+            return
+
+        if type(node) is dict:
+            if '<VAR>' in node:
+                var_lists += ((1 << depth, node['<VAR>']),)
+
+            for key, child in node.items():
+                if key not in ('<VAR>', '<END>'):
+                    self._precompute_candidates(child, depth + 1, var_lists)
+
+            bucket = node.get('<END>', ())
+
+        else:
+            bucket = node
+
+        # Replaces what an earlier version of the tree left for node
+        self._merged_candidates.pop(id(node), None)
+
+        # The number of states doubles with every such node; deep chains of them are left to _descend()
+        if not var_lists or len(var_lists) > 6:
+            return
+
+        states = {}
+
+        for count in range(1, len(var_lists) + 1):
+            for chosen in itertools.combinations(var_lists, count):
+                var_mask = sum(bit for bit, _ in chosen)
+                states[var_mask] = _merge_sorted([entry for _, var_list in chosen for entry in var_list] + list(bucket))
+
+        self._merged_candidates[id(node)] = (node, states)
+
+    # ----
+    def _steps(self, current_node, word, possible):
+        """
+        Moves one word down from a dict node, collecting <VAR> regexps that could absorb the word. possible is not changed.
+        --
+        Returns (list): (node, collected <VAR> regexps) for each edge the word fits, or for staying at current_node
+        """
+
+        # TODO :: Does this limit functionality?
+        children = self._children(current_node, word)
+
+        if children:
+            return [(child, possible) for child in children]
+
+        if '<VAR>' in current_node:
+            possible = possible + current_node['<VAR>']
+
+        return [(current_node, possible)]
+
+    # ----
+    def _finish(self, current_node, possible):
+        if type(current_node) is list:
+            possible += current_node
+
+        elif '<END>' in current_node:
+            possible += current_node['<END>']
+
+        return possible
+
+    # ----
+    def _fuzzy_candidates(self, separated, items=None):
+        """
+        Best-first traversal which may follow edges whose keys are within the maximum edit distance of an item,
+        or of two adjacent items joined together ("win amp" -> "winamp", costing one extra edit). At most
+        max_fuzzy_paths paths are completed, so latency stays bounded on large trees.
+        separated (list) : Tree keys of the text's items
+        items (list) : The items themselves, kept in the corrected text where they are not replaced; defaults to separated
+        --
+        Yields (tuple): (int) cost, (list) candidates, (tuple) items with corrections applied; cheapest first
+        """
+
+        items = separated if items is None else items
+        budget = self._max_edit_distance
+        order = itertools.count()
+
+        # (cost, tiebreaker, position in separated, node, corrected items, collected <VAR> regexps)
+        queue = [(0, next(order), 0, self._tree, (), ())]
+        completed = 0
+
+        while queue and completed < self._max_fuzzy_paths:
+            cost, _, word_pos, current_node, corrected, possible = heapq.heappop(queue)
+
+            if corrected and (word_pos >= len(separated) or len(corrected) > self._max_depth
+                              or type(current_node) is list):
+                completed += 1
+
+                # The exact path has already been tried by match()
+                if cost:
+                    yield cost, self._finish(current_node, list(possible)), corrected + tuple(items[word_pos:])
+
+                continue
+
+            word = separated[word_pos]
+            children = self._children(current_node, word)
+
+            for child in children:
+                heapq.heappush(queue, (cost, next(order), word_pos + 1, child, corrected + (items[word_pos],), possible))
+
+            if not children and corrected:
+                var_list = tuple(current_node.get('<VAR>', ()))
+                heapq.heappush(queue, (cost, next(order), word_pos + 1, current_node, corrected + (items[word_pos],), possible + var_list))
+
+            token_index = self._get_token_index(current_node)
+
+            for distance, key in token_index.lookup(word, budget - cost):
+                heapq.heappush(queue, (cost + distance, next(order), word_pos + 1, current_node[key], corrected + (key,), possible))
+
+            if word_pos + 1 < len(separated) and cost < budget:
+                joined = word + separated[word_pos + 1]
+
+                if joined in current_node:
+                    heapq.heappush(queue, (cost + 1, next(order), word_pos + 2, current_node[joined],
+                                           corrected + (items[word_pos] + items[word_pos + 1],), possible))
+
+                for distance, key in token_index.lookup(joined, budget - cost - 1):
+                    heapq.heappush(queue, (cost + distance + 1, next(order), word_pos + 2, current_node[key], corrected + (key,), possible))
+
+    # ----
+    def _get_token_index(self, node):
+        cached = self._token_indexes.get(id(node))
+
+        if cached is None or cached[0] is not node:
+            keys = (key for key in node if not _NON_LITERAL_CHARS.intersection(key))
+            cached = (node, _TokenIndex(keys, self._max_edit_distance))
+            self._token_indexes[id(node)] = cached
+
+        return cached[1]
+
+    # ----
+    def _layers(self):
+        # Trees consulted when matching against this one, in order of precedence
+        return (self,)
+
+    # ----
+    def complete(self, prefix, limit=10):
+        """
+        Lazily yields expressions that could continue prefix, highest weight first. Never calls callbacks.
+        prefix (str) : Partial text; its last item may be incomplete
+        limit (int) : Maximum number of completions (and of tree branches explored)
+        --
+        Yields (tuple): (str) expression, (str | None) the expression's item at the last position of prefix
+        """
+
+        if not self._built or limit < 1:
+            return
+
+        tokens = self._split(prefix)
+        sources = self._completion_sources(tokens, limit)
+        seen = set()
+
+        for _, _, _, expression in heapq.merge(*sources, key=itemgetter(0), reverse=True):
+            if expression in seen:
+                continue
+
+            next_token = self._continues(self._split(expression), tokens)
+            if next_token is False:
+                continue
+
+            seen.add(expression)
+            yield expression, next_token
+
+            if len(seen) >= limit:
+                return
+
+    # ----
+    def _completion_sources(self, tokens, limit):
+        """
+        Returns (list): Weight-sorted iterables of the entries stored along the path of tokens
+        """
+
+        *typed, partial = tokens
+        current_node = self._tree
+        sources = []
+        depth = 0
+
+        for word in typed:
+            if type(current_node) is list or depth > self._max_depth:
+                break
+
+            if depth and '<VAR>' in current_node:
+                sources.append(current_node['<VAR>'])
+
+            if word not in current_node:
+                return sources
+
+            current_node = current_node[word]
+            depth += 1
+
+        # Past the depth of the tree, narrow the bucket with indexes of its later items instead of merging all of it
+        if type(current_node) is list:
+            return sources + self._bucket_sources(current_node, tokens[depth:], depth, limit)
+
+        if current_node is not self._tree:
+            for key in ('<VAR>', '<END>'):
+                if key in current_node:
+                    sources.append(current_node[key])
+
+        # Only the first `limit` children starting with the partial item are explored
+        keys = self._get_sorted_keys(current_node)
+        start = bisect.bisect_left(keys, partial)
+
+        for key in keys[start:start + limit]:
+            if not key.startswith(partial):
+                break
+
+            sources.append(self._iter_entries(current_node[key]))
+
+        return sources
+
+    # ----
+    def _bucket_sources(self, bucket, tokens, position, limit):
+        """
+        Returns (list): Weight-sorted lists of the entries of bucket which may continue tokens, the first of which
+                        is at item position `position` of the expressions
+        """
+
+        *typed, partial = tokens
+        sources = []
+
+        for word in typed:
+            literal, other, _ = self._get_bucket_index(bucket, position)
+
+            if other:
+                sources.append(other)
+
+            bucket = literal.get(word)
+            if bucket is None:
+                return sources
+
+            position += 1
+
+        literal, other, keys = self._get_bucket_index(bucket, position)
+
+        if other:
+            sources.append(other)
+
+        # As with tree nodes, only the first `limit` items starting with the partial item are explored
+        start = bisect.bisect_left(keys, partial)
+
+        for key in keys[start:start + limit]:
+            if not key.startswith(partial):
+                break
+
+            sources.append(literal[key])
+
+        return sources
+
+    # ----
+    def _get_bucket_index(self, bucket, position):
+        """
+        Returns (tuple): (dict) literal item at position -> weight-sorted entries, (list) weight-sorted entries
+                         whose item at position is a variable or pattern, (list) sorted literal items
+        """
+
+        cached = self._bucket_indexes.get(id(bucket))
+
+        if cached is None or cached[0] is not bucket:
+            cached = self._bucket_indexes[id(bucket)] = (bucket, {})
+
+        index = cached[1].get(position)
+
+        if index is None:
+            literal = {}
+            other = []
+
+            for entry in bucket:
+                expression_parts = self._split(entry[3])
+
+                # Expressions ending before position cannot continue the text
+                if len(expression_parts) <= position:
+                    continue
+
+                part = expression_parts[position]
+
+                if _NON_LITERAL_CHARS.intersection(part):
+                    other.append(entry)
+                else:
+                    literal.setdefault(part, []).append(entry)
+
+            index = cached[1][position] = (literal, other, sorted(literal))
+
+        return index
+
+    # ----
+    def _get_sorted_keys(self, node):
+        cached = self._sorted_keys.get(id(node))
+
+        if cached is None or cached[0] is not node:
+            cached = (node, sorted(key for key in node if key not in ('<VAR>', '<END>')))
+            self._sorted_keys[id(node)] = cached
+
+        return cached[1]
+
+    # ----
+    def _iter_entries(self, node):
+        # All entries below node, highest weight first
+        if type(node) is list:
+            return iter(node)
+
+        return heapq.merge(*(self._iter_entries(child) for child in node.values()), key=itemgetter(0), reverse=True)
+
+    # ----
+    def _continues(self, expression_parts, tokens):
+        """
+        Returns (str | None | bool): False if the expression cannot continue tokens, otherwise the expression item
+                                     at the position of the last token (None if the expression ends before it)
+        """
+
+        last = len(tokens) - 1
+
+        for part_pos, token in enumerate(tokens):
+            if part_pos >= len(expression_parts):
+                return False
+
+            part = expression_parts[part_pos]
+
+            # Variables may span any number of items, so nothing after them can be ruled out
+            if part[0:1] == '<':
+                return part
+
+            if _NON_LITERAL_CHARS.intersection(part):
+                continue
+
+            if part_pos == last:
+                return part if part.startswith(token) else False
+
+            if part != token:
+                return False
+
+        return None
+
+    # ----
+    def _split(self, text):
+        # Tree keys of text's items
+        return self._tokenizer.tokenize(text)[1]
+
+    # ----
+    def _iter_buckets(self, node=None, path=(), inherited=()):
+        """
+        Yields (tuple) (path, bucket, inherited) for every regex list in the tree, where inherited
+        holds the <VAR> lists that a traversal ending at bucket may also have to check. Paths through the
+        suffix index start with <VAR> and continue with the expression's items from its last one backwards.
+        """
+
+        node = self._tree if node is None else node
+
+        if type(node) is list:
+            yield path, node, inherited
+            return
+
+        var_list = node.get('<VAR>')
+        if type(var_list) is dict:
+            yield from self._iter_buckets(var_list, ('<VAR>',))
+            var_list = None
+
+        elif var_list is not None:
+            yield path + ('<VAR>',), var_list, inherited
+
+        # Lookups in the suffix index start at one of its keys and never check its own <VAR> list
+        child_inherited = inherited + (var_list,) if var_list and path != ('<VAR>',) else inherited
+
+        for key, child in node.items():
+            if key in ('<VAR>', '<END>'):
+                continue
+
+            yield from self._iter_buckets(child, path + (key,), child_inherited)
+
+        if '<END>' in node:
+            yield path + ('<END>',), node['<END>'], child_inherited
+
+    # ----
+    def memory_report(self, top=10):
+        """
+        Approximates the bytes held by the tree. Objects shared between several places are counted once.
+        top (int) : Number of largest buckets to list
+        --
+        Returns (dict): see RegexCollection.memory_report
+        """
+
+        seen = set()
+        categories = dict.fromkeys(('nodes', 'buckets', 'entries', 'patterns', 'expressions', 'keys', 'raw_regexps',
+                                    'parsers', 'caches'), 0)
+
+        def size(obj, category):
+            if id(obj) in seen:
+                return 0
+
+            seen.add(id(obj))
+            obj_size = sys.getsizeof(obj)
+            categories[category] += obj_size
+
+            return obj_size
+
+        def entry_size(entry):
+            _, regex, _, expression = entry
+            return size(entry, 'entries') + size(regex, 'patterns') + size(expression, 'expressions')
+
+        buckets = []
+
+        def node_size(node, path):
+            if type(node) is list:
+                bucket_size = size(node, 'buckets') + sum(entry_size(entry) for entry in node)
+                buckets.append((self._separator.join(path), len(node), bucket_size))
+                return bucket_size
+
+            total = size(node, 'nodes')
+            for key, child in node.items():
+                total += size(key, 'keys') + node_size(child, path + (key,))
+
+            return total
+
+        size(self._tree, 'nodes')
+        branches = []
+
+        for key, child in self._tree.items():
+            branches.append((key, size(key, 'keys') + node_size(child, (key,))))
+
+        size(self._raw_regexps, 'raw_regexps')
+        for expression, regex, _ in self._raw_regexps:
+            size(expression, 'raw_regexps')
+            size(regex, 'raw_regexps')
+
+        size(self._build_parser_main, 'parsers')
+        size(self._build_parser_fill_novalue, 'parsers')
+
+        for cache in (self._sorted_keys, self._token_indexes, self._bucket_indexes, self._merged_candidates, self._callback_params):
+            size(cache, 'caches')
+
+            for value in cache.values():
+                size(value, 'caches')
+
+        branches.sort(key=itemgetter(1), reverse=True)
+        buckets.sort(key=itemgetter(2), reverse=True)
+
+        return {
+            'total': sum(categories.values()),
+            'categories': categories,
+            'branches': branches,
+            'largest_buckets': buckets[:top]
+        }
+
+    # ----
+    def analyze(self, bucket_limit=50):
+        """
+        Statically inspects the built tree for expressions that can never be matched.
+        bucket_limit (int) : Buckets whose worst-case regex count exceeds this are reported as oversized
+        --
+        Returns (dict): see RegexCollection.analyze
+        """
+
+        unreachable = []
+        shadowed = []
+        buckets = []
+
+        for path, bucket, inherited in self._iter_buckets():
+            keys = [key for key in path if key not in ('<VAR>', '<END>')]
+
+            # match() only looks up literal tokens, and expressions with variables at both ends are never looked up
+            if not keys or any(_NON_LITERAL_CHARS.intersection(key) and key not in _TYPED_EDGE_TESTS for key in keys):
+                unreachable += [expression for _, _, _, expression in bucket]
+                continue
+
+            # Show suffix index paths in the order the items appear in text
+            if path[0] == '<VAR>':
+                path = path[:1] + path[:0:-1]
+
+            # Candidates are sorted by weight the way match() merges them, so earlier ones are checked first
+            candidates = _merge_sorted([entry for var_list in inherited for entry in var_list] + bucket)
+            worst_case = len(set(id(entry[1]) for entry in candidates))
+            buckets.append((self._separator.join(path), len(bucket), worst_case))
+
+            bucket_ids = set(id(entry) for entry in bucket)
+
+            for pos, (_, regex, _, expression) in enumerate(candidates):
+                if id(candidates[pos]) not in bucket_ids:
+                    continue
+
+                # Variable names do not change what a regex matches; "play <song>" hides "play <track>"
+                pattern = _GROUP_NAME.sub('(?P<>', regex.pattern)
+                is_literal = not _NON_LITERAL_CHARS.intersection(expression)
+
+                for _, earlier_regex, _, earlier_expression in candidates[:pos]:
+                    if (_GROUP_NAME.sub('(?P<>', earlier_regex.pattern) == pattern or
+                            (is_literal and earlier_regex.match(expression))):
+                        shadowed.append((expression, earlier_expression))
+                        break
+
+        buckets.sort(key=itemgetter(2), reverse=True)
+
+        return {
+            'unreachable': unreachable,
+            'shadowed': shadowed,
+            'buckets': buckets,
+            'oversized': [bucket for bucket in buckets if bucket[2] > bucket_limit]
+        }
+
+    # ----
+    def __str__(self):
+        if self._built:
+            return f'<RegexTree (built) with {self._regex_count} regexps>'
+        else:
+            return f'<RegexTree (unbuilt) with {self._pending_count} queued regexps>'
+
+    def __repr__(self):
+        if self._built:
+            return pprint.pformat(self._tree)
+
+        else:
+            notice = '\n==\nNOTICE: Displaying queued regexps\n==\n' 
+            return f'{notice}{pprint.pformat(self._raw_regexps)}{notice}'
+
+# ----
+def _merge_sorted(entries):
+    """
+    Returns (tuple): entries without repeats, highest weight first; entries of equal weight keep their order
+    """
+
+    seen = set()
+    unique = [entry for entry in entries if id(entry) not in seen and not seen.add(id(entry))]
+
+    return tuple(sorted(unique, key=itemgetter(0), reverse=True))
+
+# ----
+def _expand_placeholder(placeholder):
+    # <name>, <name=pattern>, <name:type> or <name:type=pattern> to a named group; empty groups are filled in later
+    name, _, pattern = placeholder.groups()
+
+    if ':' in name:
+        name, _, type_name = name.partition(':')
+
+        if type_name not in _VARIABLE_TYPES:
+            raise Exception(f'Unknown variable type "{type_name}"; expected one of {", ".join(_VARIABLE_TYPES)}')
+
+        if pattern is None:
+            pattern = _VARIABLE_TYPES[type_name][0]
+
+    return f'(?P<{name}>{pattern or ""})'
+
+def _placeholder_converters(expression):
+    """
+    Returns (dict): Variable name -> converter for the expression's typed variables
+    """
+
+    converters = {}
+
+    for name, _, _ in _PLACEHOLDER_PARSER.findall(expression):
+        name, _, type_name = name.partition(':')
+        converter = _VARIABLE_TYPES.get(type_name, (None, None))[1]
+
+        if converter is not None:
+            converters[name] = converter
+
+    return converters
+
+# ----
+def _is_variable(part):
+    return part[0:1] == '<' and part[-1:] == '>'
+
+# ----
+def _accepted_params(callback):
+    """
+    Returns (frozenset | None): Names callback accepts as keyword arguments, or None if it accepts any
+    """
+
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        # No signature available (some builtins); pass everything as before
+        return None
+
+    if any(parameter.kind is parameter.VAR_KEYWORD for parameter in parameters):
+        return None
+
+    return frozenset(parameter.name for parameter in parameters
+                     if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY))
+
+def _bind_params(accepted, extra_params):
+    # Drop extra parameters the callback does not accept; only accepted ones are looked up, so lazily computed
+    # values (such as a webserver's form data) are not computed for callbacks that ignore them
+    if accepted is None or not extra_params:
+        return extra_params
+
+    return {name: extra_params[name] for name in accepted if name in extra_params}
+
+# ----
+def _edit_distance(first, second, max_distance):
+    """
+    Levenshtein distance between two strings, giving up early once it must exceed max_distance.
+    --
+    Returns (int): The distance, or max_distance + 1 if it is larger than max_distance
+    """
+
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(second) + 1))
+
+    for first_pos, first_char in enumerate(first, 1):
+        current = [first_pos]
+
+        for second_pos, second_char in enumerate(second, 1):
+            current.append(min(previous[second_pos] + 1,
+                               current[second_pos - 1] + 1,
+                               previous[second_pos - 1] + (first_char != second_char)))
+
+        if min(current) > max_distance:
+            return max_distance + 1
+
+        previous = current
+
+    return previous[-1]
+
+# ----
+class _TokenIndex:
+
+    def __init__(self, keys, max_distance):
+        """
+        Deletion-neighborhood index for approximate lookups of tree keys. Two words are within edit distance d
+        only if deleting at most d characters from each yields a common string, so every key is stored under
+        each of its deletion variants and a lookup only verifies keys sharing a variant with the word.
+        ---
+        keys (iterable) : The literal keys of one tree node
+        max_distance (int) : Largest edit distance lookups may ask for
+        """
+
+        self._max_distance = max_distance
+        self._variants = {}
+
+        for key in keys:
+            for variant in self._deletions(key, max_distance):
+                self._variants.setdefault(variant, []).append(key)
+
+    # ----
+    def add(self, keys):
+        # Keys added to the node in place
+        for key in keys:
+            for variant in self._deletions(key, self._max_distance):
+                self._variants.setdefault(variant, []).append(key)
+
+    # ----
+    @staticmethod
+    def _deletions(word, max_distance):
+        variants = {word}
+        frontier = {word}
+
+        for _ in range(max_distance):
+            frontier = {item[:pos] + item[pos + 1:] for item in frontier for pos in range(len(item))}
+            variants |= frontier
+
+        return variants
+
+    # ----
+    def lookup(self, word, max_distance):
+        """
+        Returns (list): (distance, key) for keys within max_distance of word, other than word itself; nearest first
+        """
+
+        max_distance = min(max_distance, self._max_distance)
+
+        # Too short to tell a typo from a different word
+        if max_distance < 1 or len(word) <= max_distance:
+            return []
+
+        found = {}
+        for variant in self._deletions(word, max_distance):
+            for key in self._variants.get(variant, ()):
+                if key != word and key not in found:
+                    found[key] = _edit_distance(word, key, max_distance)
+
+        return sorted((distance, key) for key, distance in found.items() if distance <= max_distance)
+
+# ----
+class RegexMatch:
+    __slots__ = ('callback', 'kwargs', 'expression')
+
+    def __init__(self, callback, kwargs, expression):
+        """
+        A matched expression whose callback has not been called yet.
+        ---
+        callback (callable) : The function bound to the expression
+        kwargs (dict) : Values extracted from the text plus the extra parameters the callback accepts
+        expression (str) : The expression that matched
+        """
+
+        self.callback = callback
+        self.kwargs = kwargs
+        self.expression = expression
+
+    # ----
+    def __call__(self):
+        return self.callback(**self.kwargs)
+
+    def __repr__(self):
+        return f'<RegexMatch "{self.expression}" -> {getattr(self.callback, "__name__", self.callback)}({self.kwargs})>'
+
+# ----
+def _merge_candidates(candidate_lists):
+    """
+    candidate_lists (iterable) : Candidate lists (or None) from trees in order of precedence
+    --
+    Returns (list): The lists merged by weight, earlier lists winning ties, or None if all were None
+    """
+
+    candidate_lists = [candidates for candidates in candidate_lists if candidates is not None]
+
+    if not candidate_lists:
+        return None
+
+    if len(candidate_lists) == 1:
+        return candidate_lists[0]
+
+    return list(heapq.merge(*candidate_lists, key=itemgetter(0), reverse=True))
+
+# ----
+class MatchStream:
+
+    def __init__(self, tree):
+        """
+        Incremental matching session over a prepared tree; see RegexCollection.stream()
+        """
+
+        self._tree = tree
+        self.reset()
+
+    # ----
+    def reset(self):
+        """
+        Discard all fed items and start over at the root of the tree.
+        """
+
+        self._tokens = []
+        self._keys = []
+
+        # (tree, current node (None once the text left the tree), collected <VAR> regexps); a tree has several
+        # states while the items fed fit several of its typed edges
+        self._states = [(layer, layer._tree, []) for layer in self._tree._layers()]
+
+    # ----
+    def feed(self, text):
+        """
+        Append one or more items of text, moving down the tree as far as each item allows.
+        ----
+        text (str) : The next item(s); split by the collection's tokenizer
+        --
+        Returns (bool): Whether any expression can still match
+        """
+
+        items, keys, _ = self._tree._tokenizer.tokenize(text)
+
+        self._keys += keys
+
+        for item, word in zip(items, keys):
+            position = len(self._tokens)
+            self._tokens.append(item)
+
+            states = []
+
+            for layer, current_node, possible in self._states:
+                if current_node is None or type(current_node) is list or position > layer._max_depth:
+                    states.append((layer, current_node, possible))
+
+                # The root's <VAR> key holds the suffix index, which is consulted by candidates()
+                elif position == 0:
+                    states += [(layer, child, possible) for child in layer._root_children(word)] or [(layer, None, possible)]
+
+                else:
+                    states += [(layer, child, child_possible) for child, child_possible in layer._steps(current_node, word, possible)]
+
+            self._states = states
+
+        return self.alive
+
+    # ----
+    def update(self, text):
+        """
+        Feed a growing hypothesis ("play", "play night", "play nightswimming"). Only the items after those
+        already fed are traversed; if an earlier item was revised the stream is reset first.
+        ----
+        text (str) : The full text recognized so far
+        --
+        Returns (bool): Whether any expression can still match
+        """
+
+        tokens = self._tree._tokenizer.tokenize(text)[0]
+        fed = len(self._tokens)
+
+        # The last fed item may still have been growing
+        if fed and tokens[:fed] != self._tokens:
+            self.reset()
+            fed = 0
+
+        if len(tokens) > fed:
+            self.feed(self._tree._separator.join(tokens[fed:]))
+
+        return self.alive
+
+    # ----
+    @property
+    def alive(self):
+        """
+        (bool) Whether the items fed so far are still in the tree, so that some expression may match. Always True
+               once an item was fed if expressions starting with a variable exist, as later items may still match them.
+        """
+
+        if not self._tokens:
+            return False
+
+        return any(current_node is not None or '<VAR>' in layer._tree for layer, current_node, _ in self._states)
+
+    # ----
+    @property
+    def text(self):
+        """
+        (str) The items fed so far, rejoined with the collection's separator
+        """
+
+        return self._tree._separator.join(self._tokens)
+
+    # ----
+    def candidates(self):
+        """
+        Returns (list): The regex entries finish() would check, in the order it would check them
+        """
+
+        if not self._tokens:
+            return []
+
+        candidate_lists = []
+        for layer in self._tree._layers():
+            finished = [layer._finish(current_node, list(possible)) for state_layer, current_node, possible in self._states
+                        if state_layer is layer and current_node is not None]
+
+            if len(finished) > 1:
+                finished = [_merge_sorted([entry for candidates in finished for entry in candidates])]
+
+            candidate_lists += finished
+
+            if '<VAR>' in layer._tree:
+                candidate_lists.append(layer._suffix_candidates(self._keys))
+
+        return _merge_candidates(candidate_lists) or []
+
+    # ----
+    def finish(self, extra_params=None):
+        """
+        Calls the callback of the most applicable surviving regex against the text fed so far.
+        ----
+        extra_params (dict) : Extra parameters to be passed to the called function
+        --
+        Returns (tuple): (bool) found match, callback result
+        """
+
+        extra_params = {} if extra_params is None else extra_params
+        resolved = next(self._tree._matches(self.text, self.candidates(), extra_params), None)
+
+        if resolved is None:
+            return False, False
+
+        return True, resolved()
+
+# ----
+class _OverlayTree(_RegexTree):
+
+    def __init__(self, base, preserve_regexps=False):
+        super().__init__(preserve_regexps=preserve_regexps, max_depth=base._max_depth,
+                         max_edit_distance=base._max_edit_distance, max_fuzzy_paths=base._max_fuzzy_paths,
+                         tokenizer=base._tokenizer)
+        self._base = base
+
+        # Base regexps are evaluated by the overlay too
+        self._callback_params = collections.ChainMap({}, base._callback_params)
+        self._converters = collections.ChainMap({}, base._converters)
+
+    # ----
+    def _candidates(self, separated):
+        return _merge_candidates((super()._candidates(separated), self._base._candidates(separated)))
+
+    # ----
+    def _fuzzy_candidates(self, separated, items=None):
+        # Cheapest first across both trees; on equal cost the overlay's paths come first
+        return heapq.merge(super()._fuzzy_candidates(separated, items), self._base._fuzzy_candidates(separated, items),
+                           key=itemgetter(0))
+
+    # ----
+    def _layers(self):
+        return (self,) + self._base._layers()
+
+    # ----
+    def _completion_sources(self, tokens, limit):
+        return super()._completion_sources(tokens, limit) + self._base._completion_sources(tokens, limit)
+
+# ----
+class RegexCollection:
+    def __init__(self, separator=' ', preserve_regexps=False, max_edit_distance=0, max_fuzzy_paths=16, tokenizer=None,
+                 max_depth=1):
+        """
+        Stores regexp-like strings containing `separator` in an optimal way to minimize time to match against any number of regexps.
+        Use an instance of RegexCollection to decorate functions using RegexpCollection.add
+        ---
+        separator (str) : The character(s) by which the stored strings will be split
+        preserve_regexps (bool) : Whether or not to preserve added expressions after RegexCollection.prepare() is called. This allows
+                                  for addition of more expressions after prepare() is called at the cost of some memory.
+        max_edit_distance (int) : When above 0, text that does not match exactly is retried along tree edges whose keys are within
+                                  this many edits of its items ("opn" -> "open", "win amp" -> "winamp"). Useful for noisy
+                                  speech transcripts; 1 or 2 is recommended.
+        max_fuzzy_paths (int) : Maximum number of approximate tree paths tried per match when max_edit_distance is above 0
+        tokenizer (Tokenizer) : How expressions and text are split into items; overrides separator. Use e.g.
+                                Tokenizer(collapse=True, casefold=True) to ignore repeated whitespace and letter case
+                                when looking up items ("Play  Nightswimming" finds "play <song>").
+        max_depth (int) : Number of leading items (trailing ones for expressions starting with a variable) the tree
+                          is keyed by. Deeper trees leave fewer regexps to try when many expressions share their first
+                          items, but a text item equal to a key of the tree is then never taken by a variable at that
+                          position, and a group such as (with|using) among those items can no longer be looked up.
+        """
+
+        self._regex_tree = _RegexTree(separator=separator, preserve_regexps=preserve_regexps, max_depth=max_depth,
+                                      max_edit_distance=max_edit_distance, max_fuzzy_paths=max_fuzzy_paths,
+                                      tokenizer=tokenizer)
+        self._prev_function = None
+        self._recorder = None
+
+    # ----
+    def add(self, expression, raw=False):
+        """
+        Decorator : Add an expression to the collection and bind it to the decorated function
+        ----
+        expression (str) : A regexp-like string to match against. Use <some_var> and <some_var=foo> to extract values from the matching text.
+                           Typed variables (<id:int>, <amount:float>, <on:date>, <at:time>, <name:word>, <name:slug>) match
+                           only values of their type, are passed to the callback converted (int, float, datetime.date,
+                           datetime.time) and let the tree pick between routes before any regex runs.
+                           Expressions starting with a variable ("<song> on spotify") are looked up by their last item(s) instead.
+        raw (bool) : Whether or not to interpret the expression as a raw regexp (skip reformatting from simpler format)
+
+        The callback's signature is inspected once here. Extra parameters passed to match() are only given to callbacks accepting
+        them (by name or through **kwargs), and prepare() fails if a callback cannot accept a value its expression extracts.
+        """
+
+        def regex_adder(callback, *args, **kwargs):
+            # Cache previous function to resolve issue with stacked decorators
+            if callback is None:
+                callback = self._prev_function
+            self._prev_function = callback
+
+            if not self._regex_tree.add(expression, callback):
+                raise Exception('Cannot add to prepared RegexCollection when preserve_regs is False')
+
+            return callback
+
+        return regex_adder
+
+    # ----
+    def match(self, text, extra_params=None):
+        """
+        Calls the most applicable regex's callback.
+        ----
+        text (str) : String to parse with the collection
+        extra_params (dict) : Extra parameters to be passed to the called function
+        --
+        Returns (tuple): (bool) found match, callback result
+        """
+
+        result = self._regex_tree.match(text, extra_params)
+
+        if result is None:
+            raise Exception('RegexCollection must be prepared before matching')
+
+        if self._recorder is not None:
+            self._recorder.record(text, result[0])
+
+        return result
+
+    # ----
+    def record(self, path, sample_rate=1.0):
+        """
+        Start logging a sample of the texts passed to match() and whether they matched, for replaying later as
+        realistic load (python -m pyretree.replay <path> <module:collection>).
+        ----
+        path (str) : Log file; appended to if it exists
+        sample_rate (float) : Fraction of calls to record, between 0 and 1
+        """
+
+        # Imported here so `python -m pyretree.replay` does not find the module already imported
+        from .replay import QueryRecorder
+
+        self.stop_recording()
+        self._recorder = QueryRecorder(path, sample_rate)
+
+    # ----
+    def stop_recording(self):
+        """
+        Stop logging started by record() and close the log.
+        """
+
+        recorder, self._recorder = self._recorder, None
+
+        if recorder is not None:
+            recorder.close()
+
+    # ----
+    def resolve(self, text, extra_params=None):
+        """
+        Finds the most applicable regex like match(), but returns it instead of calling its callback, so slow callbacks
+        can be run elsewhere (see pyretree.dispatch.Dispatcher).
+        ----
+        text (str) : String to parse with the collection
+        extra_params (dict) : Extra parameters to be passed to the callback
+        --
+        Returns (RegexMatch | None): Call it to run the callback; None if nothing matched
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before matching')
+
+        return self._regex_tree.resolve(text, extra_params)
+
+    # ----
+    def match_all(self, text, extra_params=None):
+        """
+        Every interpretation of text, best first, for ranking and disambiguation. Regexps are only evaluated as
+        matches are requested, so taking the first few does not pay for the rest. Callbacks are never called.
+        ----
+        text (str) : String to parse with the collection
+        extra_params (dict) : Extra parameters to be passed to the callbacks
+        --
+        Yields (RegexMatch): In the order match() would try them; the first is what match() would call
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before matching')
+
+        return self._regex_tree.match_all(text, extra_params)
+
+    # ----
+    def prepare(self):
+        """
+        Build the collection after expressions have been added to it. Must be called before
+        RegexCollection.match() may be used.
+        """
+
+        if not self._regex_tree.build_tree():
+            pyretree_logger.debug('RegexCollection was already prepared\n')
+
+    # ----
+    def merge(self, other, on_conflict='error'):
+        """
+        Add every expression of another prepared collection to this prepared one, e.g. to assemble a router from
+        separately prepared core, plugin and feature collections. Nothing is recompiled or re-added: branches only
+        one collection has are shared between both, and only other's branches are visited, so the work grows with
+        the size of other rather than of this collection. other stays usable; later changes to either never affect
+        the other.
+        ----
+        other (RegexCollection) : A prepared collection with the same tokenizer (overlays cannot be merged)
+        on_conflict (str) : What to do with an expression bound to different callbacks in both collections:
+                            'error' raises, 'keep' keeps this collection's, 'replace' takes other's and 'both' keeps
+                            both, this collection's tried first. The same expression bound to the same callback is
+                            always kept once.
+        """
+
+        self._regex_tree.merge(other._regex_tree, on_conflict)
+
+    # ----
+    def stream(self):
+        """
+        Start an incremental matching session for text arriving item by item, such as speech hypotheses.
+        The session keeps its position in the tree so each fed item costs one step rather than a new match.
+        ----
+        Returns (MatchStream): Use feed(item) / update(hypothesis) to add text, .alive to check whether any
+                               expression can still match and finish() to call the winning callback
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before streaming')
+
+        return MatchStream(self._regex_tree)
+
+    # ----
+    def complete(self, prefix, limit=10):
+        """
+        Suggests expressions which could continue partially entered text. Callbacks are never called.
+        ----
+        prefix (str) : Partial text to complete; its last item may be incomplete ("play vi")
+        limit (int) : Maximum number of suggestions. Also bounds the number of tree branches explored.
+        --
+        Yields (tuple): (str) expression, (str | None) the expression's item at the position of the last
+                        item of prefix ("video"), or None if the expression ends before it
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before completing')
+
+        return self._regex_tree.complete(prefix, limit)
+
+    # ----
+    def memory_report(self, top=10):
+        """
+        Accounts for the memory held by the prepared collection. Sizes are shallow sys.getsizeof() totals of every
+        object the collection holds (each counted once), so they approximate rather than equal RSS.
+        ----
+        top (int) : Number of largest buckets to list
+        --
+        Returns (dict):
+            'total' (int)            : Bytes across all categories
+            'categories' (dict)      : Bytes by category; 'nodes' (tree dicts), 'buckets' (regex lists), 'entries',
+                                       'patterns' (compiled regexps), 'expressions', 'keys', 'raw_regexps' (kept by
+                                       preserve_regexps=True), 'parsers' (expression parsers) and 'caches'
+            'branches' (list)        : (first item, bytes) for every top-level branch, largest first
+            'largest_buckets' (list) : (path, regex count, bytes) of the largest buckets
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before accounting for its memory')
+
+        return self._regex_tree.memory_report(top)
+
+    # ----
+    def analyze(self, bucket_limit=50):
+        """
+        Reports expressions that can never win a match and buckets that are expensive to miss on.
+        ----
+        bucket_limit (int) : Buckets whose worst-case regex count exceeds this are listed as oversized
+        --
+        Returns (dict):
+            'unreachable' (list) : Expressions keyed under a token that plain text can never equal, or starting and
+                                   ending with a variable
+            'shadowed' (list)    : (expression, shadowed_by) pairs where an earlier candidate always matches first
+            'buckets' (list)     : (path, size, worst-case regex count) for every bucket, largest first
+            'oversized' (list)   : The entries of 'buckets' exceeding bucket_limit
+        """
+
+        if not self._regex_tree._built:
+            raise Exception('RegexCollection must be prepared before analyzing')
+
+        return self._regex_tree.analyze(bucket_limit)
+
+    # --------
+    def __str__(self):
+        if self._regex_tree._built:
+            return f'<RegexCollection (built) with {self._regex_tree._regex_count} regexps>'
+        else:
+            return f'<RegexCollection (unbuilt) with {self._regex_tree._pending_count} unprepared regexps'
+
+    def __repr__(self):
+        if self._regex_tree._built:
+            return pprint.pformat(self._regex_tree._tree)
+
+        else:
+            notice = '\n==\nNOTICE: Displaying unprepared regexps\n==\n' 
+            return f'{notice}{pprint.pformat(self._regex_tree._raw_regexps)}{notice}'
+
+    # ----
+    def __len__(self):
+        return self._regex_tree._regex_count if self._regex_tree._regex_count else self._regex_tree._pending_count
+
+# ----
+class RegexOverlay(RegexCollection):
+    def __init__(self, base, preserve_regexps=False):
+        """
+        A RegexCollection layered over a prepared base collection. The base is referenced read-only, so an
+        overlay only holds the expressions added to it. Matching considers both, overlay expressions first
+        among those of equal weight.
+        ---
+        base (RegexCollection) : A prepared collection to layer over; shares its tokenizer
+        preserve_regexps (bool) : See RegexCollection
+        """
+
+        if not base._regex_tree._built:
+            raise Exception('Base RegexCollection must be prepared before it can be overlaid')
+
+        self._regex_tree = _OverlayTree(base._regex_tree, preserve_regexps=preserve_regexps)
+        self._prev_function = None
+        self._recorder = None
@@ -0,0 +1,165 @@
+import importlib
+import os
+import threading
+
+# --- Logging configuration
+import logging
+pyretree_logger = logging.getLogger(__name__)
+pyretree_logger.addHandler(logging.NullHandler())
+# ---
+
+
+def _fingerprint(callback):
+    # Callbacks are recreated on every import; compare what they do rather than their identity
+    code = getattr(callback, '__code__', None)
+
+    if code is None:
+        return id(callback)
+
+    return code.co_code, code.co_consts, code.co_names, getattr(callback, '__defaults__', None)
+
+# ----
+def _registrations(tree):
+    """
+    Returns (dict): (expression, callback name) -> list of entries, (weight, regex, callback, expression), stored in tree
+    """
+
+    registrations = {}
+
+    for entry in tree._entries():
+        key = (entry[3], getattr(entry[2], '__qualname__', repr(entry[2])))
+        registrations.setdefault(key, []).append(entry)
+
+    return registrations
+
+
+# --------
+class IntentReloader:
+
+    def __init__(self, module, attribute='intentions'):
+        """
+        Reloads a module of intents into its existing prepared RegexCollection. Only the (expression, callback) pairs
+        that were added, removed or changed are applied to the tree. Only the branches they belong in are copied
+        and each is swapped in at once, so matches running meanwhile see either the old or the new version of it.
+        ---
+        module (module) : An imported module that builds and prepares a RegexCollection at import
+        attribute (str) : Name of the module's RegexCollection
+        """
+
+        self._module = module
+        self._attribute = attribute
+        self._collection = getattr(module, attribute)
+
+        self._lock = threading.Lock()
+        self._mtime = self._get_mtime()
+
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    # ----
+    @property
+    def collection(self):
+        """
+        (RegexCollection) The live collection; stays the same object across reloads
+        """
+
+        return self._collection
+
+    # ----
+    def _get_mtime(self):
+        return os.stat(self._module.__file__).st_mtime_ns
+
+    # ----
+    def reload(self):
+        """
+        Re-import the module and apply the difference to the live collection. The module attribute keeps pointing
+        at the live collection, also when the import fails.
+        --
+        Returns (dict): 'added', 'removed' and 'changed' lists of (expression, callback name)
+        """
+
+        with self._lock:
+            self._mtime = self._get_mtime()
+            tree = self._collection._regex_tree
+
+            try:
+                importlib.reload(self._module)
+                fresh = getattr(self._module, self._attribute)
+
+            finally:
+                setattr(self._module, self._attribute, self._collection)
+
+            fresh_tree = fresh._regex_tree
+            if not fresh_tree._built:
+                fresh.prepare()
+
+            live_registrations = _registrations(tree)
+            fresh_registrations = _registrations(fresh_tree)
+
+            diff = {'added': [], 'removed': [], 'changed': []}
+            added, removed = [], []
+
+            for key in live_registrations.keys() | fresh_registrations.keys():
+                live = live_registrations.get(key, [])
+                new = fresh_registrations.get(key, [])
+
+                for registration_pos in range(max(len(live), len(new))):
+                    if registration_pos >= len(new):
+                        diff['removed'].append(key)
+                        removed.append(live[registration_pos])
+
+                    elif registration_pos >= len(live):
+                        diff['added'].append(key)
+                        added.append(new[registration_pos])
+
+                    elif _fingerprint(live[registration_pos][2]) != _fingerprint(new[registration_pos][2]):
+                        diff['changed'].append(key)
+                        removed.append(live[registration_pos])
+                        added.append(new[registration_pos])
+
+            if added or removed:
+                tree._apply_changes([(expression, regex, callback) for _, regex, callback, expression in added], removed)
+
+            pyretree_logger.debug(f'Reloaded {self._module.__name__}: {len(diff["added"])} added, '
+                                  f'{len(diff["removed"])} removed, {len(diff["changed"])} changed\n')
+
+            return diff
+
+    # ----
+    def watch(self, interval=1.0):
+        """
+        Reload in a background thread whenever the module's file changes. Errors while reloading are logged and the
+        previous intents stay in place.
+        ----
+        interval (float) : Seconds between checks of the file's modification time
+        """
+
+        if self._watcher is not None:
+            return
+
+        self._stop_watching.clear()
+
+        def watch_loop():
+            while not self._stop_watching.wait(interval):
+                try:
+                    if self._get_mtime() != self._mtime:
+                        self.reload()
+
+                except Exception:
+                    pyretree_logger.exception(f'Reloading {self._module.__name__} failed')
+
+        self._watcher = threading.Thread(target=watch_loop, daemon=True)
+        self._watcher.start()
+
+    # ----
+    def stop(self):
+        """
+        Stop watching started by watch().
+        """
+
+        if self._watcher is None:
+            return
+
+        self._stop_watching.set()
+        self._watcher.join()
+        self._watcher = None
@@ -0,0 +1,143 @@
+import argparse
+import importlib
+import json
+import random
+import threading
+import time
+
+# Each record is one line: 1 or 0 for whether the text matched, a tab, then the text as a JSON string
+_LOG_HEADER = '# pyretree query log v1\n'
+
+
+class QueryRecorder:
+
+    def __init__(self, path, sample_rate=1.0):
+        """
+        Appends a sample of matched texts and their outcomes to a log file; see RegexCollection.record()
+        ---
+        path (str) : Log file to append to
+        sample_rate (float) : Fraction of calls to record, between 0 and 1
+        """
+
+        self.sample_rate = sample_rate
+
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+        if self._file.tell() == 0:
+            self._file.write(_LOG_HEADER)
+
+    # ----
+    def record(self, text, matched):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+
+        line = f'{int(bool(matched))}\t{json.dumps(text)}\n'
+
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    # ----
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# --------
+def read_log(path):
+    """
+    Returns (list): (str) text, (bool) whether it matched when recorded; for every record in the log
+    """
+
+    records = []
+
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.startswith('#') or not line.strip():
+                continue
+
+            matched, text = line.rstrip('\n').split('\t', 1)
+            records.append((json.loads(text), matched == '1'))
+
+    return records
+
+# ----
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+# ----
+def replay(collection, path, rate=None, loops=1, callbacks=False):
+    """
+    Drive a prepared collection with a recorded query log and measure it.
+    ----
+    collection (RegexCollection) : Prepared collection to measure
+    path (str) : Log written by RegexCollection.record()
+    rate (float) : Target queries per second; None replays as fast as possible
+    loops (int) : Number of passes over the log
+    callbacks (bool) : Call the matched callbacks (match) rather than only resolving them (resolve)
+    --
+    Returns (dict): queries, seconds, throughput (queries/second), matched, mismatched (outcome differs from the log)
+                    and latency percentiles p50, p90, p99 and max in seconds
+    """
+
+    records = read_log(path) * loops
+    match = collection.match if callbacks else collection.resolve
+    interval = None if rate is None else 1 / rate
+
+    latencies = []
+    matched = mismatched = 0
+
+    start = time.perf_counter()
+
+    for record_pos, (text, was_matched) in enumerate(records):
+        if interval is not None:
+            delay = start + record_pos * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        query_start = time.perf_counter()
+        result = match(text)
+        latencies.append(time.perf_counter() - query_start)
+
+        is_matched = result[0] if callbacks else result is not None
+        matched += is_matched
+        mismatched += is_matched != was_matched
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    report = {
+        'queries': len(records),
+        'seconds': elapsed,
+        'throughput': len(records) / elapsed if elapsed else 0,
+        'matched': matched,
+        'mismatched': mismatched,
+    }
+
+    for name, percent in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+        report[name] = _percentile(latencies, percent) if latencies else 0
+
+    return report
+
+
+# --------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a pyretree query log against a collection and report throughput and latency.')
+    parser.add_argument('log', help='Query log written by RegexCollection.record()')
+    parser.add_argument('collection', help='Prepared collection to replay against, as module:attribute (e.g. voice_intents:intentions)')
+    parser.add_argument('--rate', type=float, default=None, help='Target queries per second (default: as fast as possible)')
+    parser.add_argument('--loops', type=int, default=1, help='Number of passes over the log')
+    parser.add_argument('--callbacks', action='store_true', help='Call matched callbacks instead of only resolving them')
+    args = parser.parse_args()
+
+    module_name, _, attribute = args.collection.partition(':')
+    collection = getattr(importlib.import_module(module_name), attribute or 'intentions')
+
+    report = replay(collection, args.log, rate=args.rate, loops=args.loops, callbacks=args.callbacks)
+
+    print(f'{report["queries"]} queries in {report["seconds"]:.3f}s ({report["throughput"]:.0f} queries/second)')
+    print(f'{report["matched"]} matched, {report["mismatched"]} differ from the log')
+
+    for name in ('p50', 'p90', 'p99', 'max'):
+        print(f'{name}: {report[name] * 1e6:.1f} microseconds')
@@ -0,0 +1,301 @@
+import os
+import threading
+import multiprocessing
+import zlib
+
+from multiprocessing.reduction import ForkingPickler
+
+from .helpers import RegexCollection, Tokenizer, _NON_LITERAL_CHARS
+
+# --- Logging configuration
+import logging
+pyretree_logger = logging.getLogger(__name__)
+pyretree_logger.addHandler(logging.NullHandler())
+# ---
+
+
+def _shard_worker(connection, collection_kwargs, entries):
+    # Runs in the worker process; builds only the expressions routed to this shard
+    collection = RegexCollection(**collection_kwargs)
+
+    for expression, raw, callback in entries:
+        collection.add(expression, raw=raw)(callback)
+
+    collection.prepare()
+
+    while True:
+        try:
+            batch = connection.recv()
+        except EOFError:
+            return
+
+        # Sent by ShardedRegexCollection.close()
+        if batch is None:
+            return
+
+        results = []
+        for text, extra_params in batch:
+            try:
+                results.append((True, collection.match(text, extra_params)))
+
+            except Exception as ex:
+                results.append((False, ex))
+
+        try:
+            connection.send(results)
+
+        except Exception:
+            # Some callback result or exception could not be pickled; replace only those, so the reply always goes out
+            connection.send([entry if _picklable(entry) else (False, Exception(repr(entry[1]))) for entry in results])
+
+# ----
+def _picklable(entry):
+    try:
+        ForkingPickler.dumps(entry)
+    except Exception:
+        return False
+
+    return True
+
+
+# ----
+class ShardedRegexCollection:
+    def __init__(self, shards=None, separator=' ', context=None, tokenizer=None, **collection_kwargs):
+        """
+        A RegexCollection partitioned across worker processes by the first item of each expression, so matching
+        is not limited to one core by the GIL. Each worker builds and matches only its own shard; match() is routed
+        to the single shard which can hold the text's first item.
+        ---
+        shards (int) : Number of worker processes; defaults to the number of CPUs
+        separator (str) : See RegexCollection
+        tokenizer (Tokenizer) : See RegexCollection; texts are routed by the tree key of their first item
+        context (multiprocessing.context.BaseContext) : Process start method. Defaults to 'fork' where available, so
+                                                        callbacks are inherited by workers as-is; other methods require
+                                                        callbacks (and their results) to be picklable.
+        collection_kwargs : Passed to each shard's RegexCollection. Approximate matching (max_edit_distance)
+                            only corrects items after the first, which decides the shard.
+        """
+
+        if context is None:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            context = multiprocessing.get_context(start_method)
+
+        self._shard_count = shards if shards is not None else (os.cpu_count() or 1)
+        self._tokenizer = tokenizer if tokenizer is not None else Tokenizer(separator)
+        self._context = context
+        self._collection_kwargs = dict(collection_kwargs, tokenizer=self._tokenizer)
+
+        self._registered = []
+        self._prev_function = None
+
+        self._shard_entries = []
+        self._workers = []
+        self._connections = []
+        self._locks = []
+
+    # ----
+    def add(self, expression, raw=False):
+        """
+        Decorator : Add an expression to the collection and bind it to the decorated function. See RegexCollection.add
+        """
+
+        def regex_adder(callback, *args, **kwargs):
+            # Cache previous function to resolve issue with stacked decorators
+            if callback is None:
+                callback = self._prev_function
+            self._prev_function = callback
+
+            if self._workers:
+                raise Exception('Cannot add to prepared ShardedRegexCollection')
+
+            self._registered.append((expression, raw, callback))
+
+            return callback
+
+        return regex_adder
+
+    # ----
+    def _shard_for(self, first):
+        return zlib.crc32(first.encode('utf-8')) % self._shard_count
+
+    # ----
+    def prepare(self):
+        """
+        Start the worker processes; each builds the collection for its shard. Must be called before matching.
+        """
+
+        if self._workers:
+            pyretree_logger.debug('ShardedRegexCollection was already prepared\n')
+            return
+
+        shards = [[] for _ in range(self._shard_count)]
+
+        for entry in self._registered:
+            first = self._tokenizer.tokenize(entry[0])[1][0]
+
+            # Expressions not keyed by a literal first item cannot be routed, so every shard holds them
+            if _NON_LITERAL_CHARS.intersection(first):
+                for shard in shards:
+                    shard.append(entry)
+            else:
+                shards[self._shard_for(first)].append(entry)
+
+        self._shard_entries = shards
+
+        for shard in range(self._shard_count):
+            self._workers.append(None)
+            self._connections.append(None)
+            self._locks.append(threading.Lock())
+
+            self._start_worker(shard)
+
+    # ----
+    def _start_worker(self, shard):
+        parent_connection, child_connection = self._context.Pipe()
+
+        worker = self._context.Process(target=_shard_worker, args=(child_connection, self._collection_kwargs,
+                                                                   self._shard_entries[shard]), daemon=True)
+        worker.start()
+        child_connection.close()
+
+        self._workers[shard] = worker
+        self._connections[shard] = parent_connection
+
+    # ----
+    def _restart_worker(self, shard):
+        # The shard's pipe failed, so replies in it can no longer be matched to requests; start over with a new worker
+        pyretree_logger.warning(f'Restarting the worker of shard {shard} after its connection failed\n')
+
+        self._connections[shard].close()
+        self._workers[shard].terminate()
+        self._workers[shard].join()
+
+        self._start_worker(shard)
+
+    # ----
+    def _receive(self, shard):
+        results = []
+
+        for success, result in self._connections[shard].recv():
+            if not success:
+                raise result
+
+            results.append(result)
+
+        return results
+
+    # ----
+    def match(self, text, extra_params=None):
+        """
+        Calls the most applicable regex's callback in the worker holding the text's shard.
+        ----
+        text (str) : String to parse with the collection
+        extra_params (dict) : Extra parameters to be passed to the called function; must be picklable
+        --
+        Returns (tuple): (bool) found match, callback result
+        """
+
+        return self.match_many((text,), extra_params)[0]
+
+    # ----
+    def match_many(self, texts, extra_params=None):
+        """
+        Match several texts at once. Texts are batched per shard and all shards work in parallel.
+        ----
+        texts (iterable) : Strings to parse with the collection
+        extra_params (dict) : Extra parameters passed to every called function; must be picklable
+        --
+        Returns (list): (bool, callback result) for each text, in order
+        """
+
+        if not self._workers:
+            raise Exception('ShardedRegexCollection must be prepared before matching')
+
+        batches = {}
+        for text_pos, text in enumerate(texts):
+            shard = self._shard_for(self._tokenizer.tokenize(text)[1][0])
+            batches.setdefault(shard, []).append((text_pos, text))
+
+        # Locks are always taken in the same order so concurrent callers cannot deadlock
+        shards = sorted(batches)
+        for shard in shards:
+            self._locks[shard].acquire()
+
+        try:
+            results = [None] * sum(len(batch) for batch in batches.values())
+            errors = []
+            sent = []
+
+            for shard in shards:
+                try:
+                    self._connections[shard].send([(text, extra_params) for _, text in batches[shard]])
+                    sent.append(shard)
+
+                # Nothing was written if the batch could not be pickled; otherwise the pipe itself failed
+                except OSError as ex:
+                    errors.append(ex)
+                    self._restart_worker(shard)
+
+                except Exception as ex:
+                    errors.append(ex)
+
+            # Every sent batch's reply must be received, even after an error, to keep the pipes in sync
+            for shard in sent:
+                try:
+                    for (text_pos, _), result in zip(batches[shard], self._receive(shard)):
+                        results[text_pos] = result
+
+                except (OSError, EOFError) as ex:
+                    errors.append(ex)
+                    self._restart_worker(shard)
+
+                except Exception as ex:
+                    errors.append(ex)
+
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+
+        if errors:
+            raise errors[0]
+
+        return results
+
+    # ----
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        for connection, lock in zip(self._connections, self._locks):
+            with lock:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+
+                connection.close()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._shard_entries = []
+        self._workers = []
+        self._connections = []
+        self._locks = []
+
+    # ----
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    # --------
+    def __str__(self):
+        state = 'built' if self._workers else 'unbuilt'
+        return f'<ShardedRegexCollection ({state}) with {len(self._registered)} regexps in {self._shard_count} shards>'
+
+    # ----
+    def __len__(self):
+        return len(self._registered)
@@ -0,0 +1,357 @@
+import heapq
+import mmap
+import re
+import struct
+
+from .helpers import Tokenizer, _TYPED_EDGE_TESTS, _accepted_params, _bind_params, _placeholder_converters
+
+# --- Logging configuration
+import logging
+pyretree_logger = logging.getLogger(__name__)
+pyretree_logger.addHandler(logging.NullHandler())
+# ---
+
+# Layout (all integers little-endian unsigned 32-bit):
+#   header  : magic, version, regex flags, max depth, separator (offset, length), suffix index root node (0 if
+#             none), whether there are typed edges, then (offset, count) of the string, node, edge and entry tables
+#   strings : utf-8 bytes of every key, pattern and expression, deduplicated
+#   nodes   : edge start/count, <VAR> entry start/count, <END> (or leaf) entry start/count, is-leaf flag
+#   edges   : key (offset, length), child node; sorted by key bytes within each node for binary search
+#   entries : weight, pattern (offset, length), expression (offset, length), callback number
+_MAGIC = b'PRTI'
+_VERSION = 3
+
+_HEADER = struct.Struct('<4sIIIIIIIIIIIIIII')
+_NODE = struct.Struct('<IIIIIII')
+_EDGE = struct.Struct('<III')
+_ENTRY = struct.Struct('<IIIIII')
+
+
+class SharedIndex:
+
+    def __init__(self, buffer, callbacks, tokenizer=None):
+        """
+        Read-only copy of a prepared RegexCollection's tree stored in one contiguous buffer. Lookups read the buffer
+        through a memoryview, so processes forked after the index is created share its pages instead of copying
+        them as refcounts change. Regexps are compiled lazily, once per process, the first time they are needed.
+        Use SharedIndex.from_collection() to create one.
+        ---
+        buffer (bytes-like) : Buffer produced by SharedIndex.from_collection(); usually an mmap
+        callbacks (list) : Callbacks referenced by the buffer's entries, in the order returned by from_collection()
+        tokenizer (Tokenizer) : The exported collection's tokenizer; only its separator is stored in the buffer, so
+                                other tokenizers must be passed again when loading
+        """
+
+        self._buffer = memoryview(buffer)
+        self._callbacks = callbacks
+
+        (magic, version, self._regex_flags, self._max_depth, separator_offset, separator_length, self._suffix_root,
+         self._typed_edges, self._strings, _, self._nodes, _, self._edges, _, self._entries, self._entry_count) = _HEADER.unpack_from(self._buffer)
+
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception('Buffer does not contain a pyretree SharedIndex')
+
+        self._separator = self._string(separator_offset, separator_length)
+        self._tokenizer = tokenizer if tokenizer is not None else Tokenizer(self._separator)
+
+        # entry number -> (compiled regex, callback, accepted parameters, converters); per-process, filled lazily
+        self._compiled = {}
+
+    # ----
+    @classmethod
+    def from_collection(cls, collection, path=None):
+        """
+        Export a prepared RegexCollection. The collection may be discarded afterwards.
+        ----
+        collection (RegexCollection) : A prepared collection (overlays are not supported)
+        path (str) : If given, the index is written to this file and mapped from it; otherwise an anonymous shared
+                     mapping is used, which is shared with processes forked afterwards
+        --
+        Returns (SharedIndex)
+        """
+
+        tree = collection._regex_tree
+
+        if not tree._built:
+            raise Exception('RegexCollection must be prepared before it can be exported')
+
+        if len(tree._layers()) > 1:
+            raise Exception('RegexOverlay cannot be exported to a SharedIndex')
+
+        data, callbacks = _export_tree(tree)
+
+        if path is None:
+            buffer = mmap.mmap(-1, len(data))
+            buffer.write(data)
+
+        else:
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            with open(path, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(buffer, callbacks, tree._tokenizer)
+
+    # ----
+    @classmethod
+    def load(cls, path, callbacks, tokenizer=None):
+        """
+        Map an index previously written by SharedIndex.from_collection(collection, path).
+        ----
+        path (str) : Path of the index file
+        callbacks (list) : The callbacks list of the SharedIndex that wrote the file
+        tokenizer (Tokenizer) : The tokenizer of the exported collection, unless it only set a separator
+        --
+        Returns (SharedIndex)
+        """
+
+        with open(path, 'rb') as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), callbacks, tokenizer)
+
+    # ----
+    def _string(self, offset, length):
+        return str(self._buffer[self._strings + offset:self._strings + offset + length], 'utf-8')
+
+    # ----
+    def _find_child(self, node, word):
+        edge_start, edge_count = _NODE.unpack_from(self._buffer, self._nodes + node * _NODE.size)[:2]
+        word = word.encode('utf-8')
+        strings = self._strings
+
+        low, high = edge_start, edge_start + edge_count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, child = _EDGE.unpack_from(self._buffer, self._edges + middle * _EDGE.size)
+            key = self._buffer[strings + key_offset:strings + key_offset + key_length]
+
+            if key == word:
+                return child
+
+            if bytes(key) < word:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    # ----
+    def _children(self, node, word):
+        # Mirrors _RegexTree._children: the literal edge, then every typed edge fitting word, narrowest type first
+        children = [self._find_child(node, word)]
+
+        if self._typed_edges:
+            children += [self._find_child(node, key) for key, test in _TYPED_EDGE_TESTS.items() if test(word)]
+
+        return [child for child in children if child is not None]
+
+    # ----
+    def _candidates(self, separated):
+        # Mirrors _RegexTree._candidates; returns entry numbers instead of entries
+        possible = self._descend_each(self._children(0, separated[0]), separated[1:self._max_depth + 1])
+
+        if self._suffix_root:
+            suffix_possible = self._descend_each(self._children(self._suffix_root, separated[-1]),
+                                                 separated[-2:-self._max_depth - 2:-1])
+
+            if suffix_possible is not None:
+                possible = suffix_possible if possible is None else list(heapq.merge(possible, suffix_possible,
+                                                                                     key=self._weight, reverse=True))
+
+        return possible
+
+    # ----
+    def _descend_each(self, nodes, words):
+        if not nodes:
+            return None
+
+        if len(nodes) == 1:
+            return self._descend(nodes[0], words)
+
+        return self._merge([self._descend(node, words) for node in nodes])
+
+    # ----
+    def _merge(self, candidate_lists):
+        # Entries of several tree paths without repeats, highest weight first
+        return sorted(dict.fromkeys(entry for candidates in candidate_lists for entry in candidates), key=self._weight, reverse=True)
+
+    # ----
+    def _weight(self, entry):
+        return _ENTRY.unpack_from(self._buffer, self._entries + entry * _ENTRY.size)[0]
+
+    # ----
+    def _descend(self, current_node, words):
+        possible = []
+
+        for word_pos, word in enumerate(words):
+            _, _, var_start, var_count, _, _, is_leaf = _NODE.unpack_from(self._buffer, self._nodes + current_node * _NODE.size)
+
+            if is_leaf:
+                break
+
+            children = self._children(current_node, word)
+
+            # The word fits several edges; every path is followed
+            if len(children) > 1:
+                return self._merge([possible + self._descend(child, words[word_pos + 1:]) for child in children])
+
+            if children:
+                current_node = children[0]
+            else:
+                possible += range(var_start, var_start + var_count)
+
+        end_start, end_count = _NODE.unpack_from(self._buffer, self._nodes + current_node * _NODE.size)[4:6]
+        possible += range(end_start, end_start + end_count)
+
+        return possible
+
+    # ----
+    def _entry(self, entry):
+        compiled = self._compiled.get(entry)
+
+        if compiled is None:
+            (_, pattern_offset, pattern_length, expression_offset, expression_length,
+             callback) = _ENTRY.unpack_from(self._buffer, self._entries + entry * _ENTRY.size)
+            callback = self._callbacks[callback]
+            compiled = (re.compile(self._string(pattern_offset, pattern_length), flags=self._regex_flags), callback,
+                        _accepted_params(callback), _placeholder_converters(self._string(expression_offset, expression_length)))
+            self._compiled[entry] = compiled
+
+        return compiled
+
+    # ----
+    def match(self, text, extra_params=None):
+        """
+        Calls the most applicable regex's callback; behaves like RegexCollection.match.
+        ----
+        text (str) : String to parse with the index
+        extra_params (dict) : Extra parameters to be passed to the called function
+        --
+        Returns (tuple): (bool) found match, callback result
+        """
+
+        extra_params = {} if extra_params is None else extra_params
+        _, keys, text = self._tokenizer.tokenize(text)
+        possible = self._candidates(keys)
+
+        # Text is not in the index
+        if possible is None:
+            return False, False
+
+        for entry in possible:
+            regex, callback, accepted, converters = self._entry(entry)
+            extracted = regex.match(text)
+
+            if extracted:
+                kwargs = extracted.groupdict()
+
+                try:
+                    for name, converter in converters.items():
+                        if kwargs[name] is not None:
+                            kwargs[name] = converter(kwargs[name])
+
+                except ValueError:
+                    continue
+
+                return True, callback(**kwargs, **_bind_params(accepted, extra_params))
+
+        return False, False
+
+    # --------
+    def __str__(self):
+        return f'<SharedIndex with {self._entry_count} regexps in {len(self._buffer)} bytes>'
+
+    # ----
+    def __len__(self):
+        return self._entry_count
+
+
+# --------
+def _export_tree(tree):
+    """
+    Returns (tuple): (bytes) serialized index, (list) callbacks in the order entries refer to them
+    """
+
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_string(text):
+        if text not in string_offsets:
+            string_offsets[text] = len(strings)
+            strings.extend(text.encode('utf-8'))
+
+        return string_offsets[text], len(text.encode('utf-8'))
+
+    callbacks = []
+    callback_numbers = {}
+
+    entries = bytearray()
+    entry_count = 0
+
+    def add_entries(bucket):
+        nonlocal entry_count
+        start = entry_count
+
+        for weight, regex, callback, expression in bucket:
+            if id(callback) not in callback_numbers:
+                callback_numbers[id(callback)] = len(callbacks)
+                callbacks.append(callback)
+
+            entries.extend(_ENTRY.pack(weight, *add_string(regex.pattern), *add_string(expression), callback_numbers[id(callback)]))
+            entry_count += 1
+
+        return start, entry_count - start
+
+    # Number nodes breadth-first so each node's children are known before its edges are written. The suffix index
+    # (the root's <VAR> key) is numbered right after the root.
+    suffix_index = tree._tree.get('<VAR>')
+    ordered = [tree._tree] + ([suffix_index] if suffix_index is not None else [])
+    node_pos = 0
+    while node_pos < len(ordered):
+        node = ordered[node_pos]
+        node_pos += 1
+
+        if type(node) is dict:
+            ordered += [child for key, child in node.items() if key not in ('<VAR>', '<END>')]
+
+    nodes = bytearray()
+    edges = bytearray()
+    edge_count = 0
+    node_number = 0 if suffix_index is None else 1
+
+    for node in ordered:
+        if type(node) is list:
+            nodes.extend(_NODE.pack(0, 0, 0, 0, *add_entries(node), 1))
+            continue
+
+        keys = sorted((key for key in node if key not in ('<VAR>', '<END>')), key=lambda key: key.encode('utf-8'))
+        edge_start = edge_count
+
+        # Children were queued in dict order directly after all previously numbered nodes
+        children = {}
+        for key, child in node.items():
+            if key not in ('<VAR>', '<END>'):
+                node_number += 1
+                children[key] = node_number
+
+        for key in keys:
+            edges.extend(_EDGE.pack(*add_string(key), children[key]))
+            edge_count += 1
+
+        var_range = add_entries(node.get('<VAR>', ()) if node is not tree._tree else ())
+        end_range = add_entries(node.get('<END>', ()))
+
+        nodes.extend(_NODE.pack(edge_start, len(keys), *var_range, *end_range, 0))
+
+    separator = add_string(tree._separator)
+
+    strings_offset = _HEADER.size
+    nodes_offset = strings_offset + len(strings)
+    edges_offset = nodes_offset + len(nodes)
+    entries_offset = edges_offset + len(edges)
+
+    header = _HEADER.pack(_MAGIC, _VERSION, tree._regex_flags, tree._max_depth, *separator,
+                          1 if suffix_index is not None else 0, int(tree._typed_edges), strings_offset, len(strings), nodes_offset, len(ordered), edges_offset, edge_count,
+                          entries_offset, entry_count)
+
+    return bytes(header + strings + nodes + edges + entries), callbacks
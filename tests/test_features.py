@@ -0,0 +1,513 @@
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import gc
+import importlib
+import re
+import tempfile
+import threading
+import weakref
+
+from pyretree import pyretree
+from pyretree.pyretree import replay
+
+
+# Each check builds its own collection and returns {description: (result, expected)}
+
+
+def build(expressions, **kwargs):
+    intentions = pyretree.RegexCollection(**kwargs)
+
+    for expression in expressions:
+        intentions.add(expression)(lambda expression=expression, **params: (expression, params))
+
+    intentions.prepare()
+
+    return intentions
+
+
+# ================================
+def check_analyze():
+    intentions = build(['play <song>', 'play <track>', 'play', 'play music', 'play (music|songs)',
+                        '<first> <second>', 'open <file> (with|using) <app>'])
+
+    report = intentions.analyze(bucket_limit=3)
+
+    return {
+        'variable names do not matter'      : ({'play <song>', 'play <track>'} in map(set, report['shadowed']), True),
+        'literal caught by a group'         : (('play music', 'play (music|songs)') in report['shadowed'], True),
+        'variables at both ends'            : (report['unreachable'], ['<first> <second>']),
+        'largest bucket first'              : (report['buckets'][0][:2], ('play', 5)),
+        'oversized buckets'                 : ([path for path, _, _ in report['oversized']], ['play']),
+    }
+
+
+# ================================
+def check_suffix_index():
+    intentions = build(['<request> on spotify', '<request> on <service:word> now', '<anything>', 'play <song>'])
+
+    buckets = {path: worst_case for path, _, worst_case in intentions.analyze()['buckets']}
+
+    return {
+        'leading variable'                  : (intentions.match('shuffle my likes on spotify'),
+                                               (True, ('<request> on spotify', {'request': 'shuffle my likes'}))),
+        'typed variable before last item'   : (intentions.match('play it on vinyl now')[1][0], '<request> on <service:word> now'),
+        'last item not indexed'             : (intentions.match('shuffle my likes on vinyl'), (False, False)),
+        'own <VAR> list is not inherited'   : (buckets['<VAR> spotify'], 1),
+    }
+
+
+# ================================
+def check_max_depth():
+    expressions = ['play', 'play <song>', 'play video <video>', 'play video <video> with <player>', 'play video now',
+                   '<request> on spotify', '<request> on my phone', 'stop', 'stop the music now']
+    texts = ['play', 'play cats', 'play video cats', 'play video cats with vlc', 'play video now', 'cats on spotify',
+             'cats on my phone', 'stop the music now', 'stop the music']
+
+    shallow = build(expressions)
+    deep = build(expressions, max_depth=3)
+
+    return {
+        'shorter expressions end early'     : (deep.match('play'), (True, ('play', {}))),
+        'same matches as depth 1'           : ([deep.match(text) for text in texts], [shallow.match(text) for text in texts]),
+        'candidates precomputed'            : (len(deep._regex_tree._merged_candidates) > 0, True),
+    }
+
+
+# ================================
+def check_overlay():
+    base = build(['play <song>', 'play video <video>', 'stop'])
+    overlay = pyretree.RegexOverlay(base)
+
+    for expression in ('play <track>', 'play something new', 'pause'):
+        overlay.add(expression)(lambda expression=expression, **params: ('overlay', expression))
+
+    overlay.prepare()
+
+    return {
+        'overlay wins a tie'                : (overlay.match('play cats'), (True, ('overlay', 'play <track>'))),
+        'heavier base expression wins'      : (overlay.match('play video cats')[1][0], 'play video <video>'),
+        'base only'                         : (overlay.match('stop'), (True, ('stop', {}))),
+        'overlay only'                      : (overlay.match('pause'), (True, ('overlay', 'pause'))),
+        'base unchanged'                    : ((base.match('pause'), base.match('play cats')[1][0]),
+                                               ((False, False), 'play <song>')),
+        'counts only its own expressions'   : (len(overlay), 3),
+    }
+
+
+# ================================
+def check_complete():
+    intentions = build(['play', 'play <song>', 'play video <video>', 'play video <video> with <player>', 'stop the music'])
+
+    return {
+        'constant first'                    : (next(intentions.complete('pl')), ('play', 'play')),
+        'item at the last position'         : (list(intentions.complete('play vi', 2)),
+                                               [('play video <video> with <player>', 'video'), ('play video <video>', 'video')]),
+        'limit'                             : (len(list(intentions.complete('pl', 2))), 2),
+        'single match'                      : (list(intentions.complete('st')), [('stop the music', 'stop')]),
+        'nothing to complete'               : (list(intentions.complete('x')), []),
+    }
+
+
+# ================================
+def check_stream():
+    intentions = build(['play <song>', 'play video <video>', 'play <count:int> songs', '<request> on spotify'])
+
+    fed = intentions.stream()
+    fed_alive = [fed.feed(item) for item in ('play', 'video', 'cats')]
+
+    revised = intentions.stream()
+    revised.update('play vid')
+    revised.update('play video dogs')
+
+    suffix = intentions.stream()
+    suffix.feed('shuffle my likes')
+    suffix.feed('on spotify')
+
+    typed = intentions.stream()
+    typed.feed('play 12 songs')
+
+    dead = build(['play <song>', 'stop']).stream()
+
+    return {
+        'item by item'                      : ((fed_alive, fed.finish()),
+                                               ([True, True, True], (True, ('play video <video>', {'video': 'cats'})))),
+        'growing hypothesis'                : ((revised.text, revised.finish()[1][0]), ('play video dogs', 'play video <video>')),
+        'leading variable'                  : (suffix.finish()[1], ('<request> on spotify', {'request': 'shuffle my likes'})),
+        'typed edge'                        : (typed.finish()[1], ('play <count:int> songs', {'count': 12})),
+        'left the tree'                     : ((dead.feed('jump'), dead.finish()), (False, (False, False))),
+    }
+
+
+# ================================
+def check_fuzzy():
+    expressions = ['open <app>', 'play video <video>', 'winamp <command>', 'stop']
+    intentions = build(expressions, max_edit_distance=1)
+
+    return {
+        'missing letter'                    : (intentions.match('opn slack'), (True, ('open <app>', {'app': 'slack'}))),
+        'wrong letter'                      : (intentions.match('ploy video cats')[1][0], 'play video <video>'),
+        'split item'                        : (intentions.match('win amp pause'), (True, ('winamp <command>', {'command': 'pause'}))),
+        'exact text still wins'             : (intentions.match('stop'), (True, ('stop', {}))),
+        'too far'                           : (intentions.match('opnne slack'), (False, False)),
+        'off by default'                    : (build(expressions).match('opn slack'), (False, False)),
+    }
+
+
+# ================================
+def check_sharded():
+    with pyretree.ShardedRegexCollection(shards=2) as intentions:
+        for expression in ('play <song>', 'stop', 'open <app>', 'volume <level:int>'):
+            intentions.add(expression)(lambda expression=expression, **params: (expression, params))
+
+        @intentions.add('where')
+        def where():
+            return os.getpid()
+
+        @intentions.add('lock')
+        def lock():
+            return threading.Lock()
+
+        intentions.prepare()
+
+        try:
+            intentions.match('lock')
+            unpicklable = 'returned'
+        except Exception:
+            unpicklable = 'raised'
+
+        return {
+            'in order across shards'            : (intentions.match_many(['play cats', 'stop', 'open slack', 'volume 7', 'jump']),
+                                                   [(True, ('play <song>', {'song': 'cats'})), (True, ('stop', {})),
+                                                    (True, ('open <app>', {'app': 'slack'})),
+                                                    (True, ('volume <level:int>', {'level': 7})), (False, False)]),
+            'called in a worker'                : (intentions.match('where')[1] != os.getpid(), True),
+            'extra parameters'                  : (intentions.match('stop', {'source': 'tests'}), (True, ('stop', {'source': 'tests'}))),
+            'unpicklable result'                : (unpicklable, 'raised'),
+            'usable after an error'             : (intentions.match('stop'), (True, ('stop', {}))),
+        }
+
+
+# ================================
+def check_shared_index():
+    expressions = ['play <song>', 'play video <video>', 'play <count:int> songs', '<request> on spotify', 'stop']
+    texts = ['play cats', 'play video cats', 'play 12 songs', 'shuffle my likes on spotify', 'stop', 'jump']
+
+    intentions = build(expressions)
+    index = pyretree.SharedIndex.from_collection(intentions)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'intents.index')
+        written = pyretree.SharedIndex.from_collection(build(expressions, max_depth=2), path)
+        loaded = pyretree.SharedIndex.load(path, written._callbacks)
+        loaded_matches = [loaded.match(text) for text in texts]
+
+    try:
+        pyretree.SharedIndex.from_collection(pyretree.RegexOverlay(intentions))
+        overlay = 'exported'
+    except Exception:
+        overlay = 'raised'
+
+    return {
+        'same matches as the collection'    : ([index.match(text) for text in texts], [intentions.match(text) for text in texts]),
+        'loaded from a file'                : (loaded_matches, [intentions.match(text) for text in texts]),
+        'expression count'                  : (len(index), len(intentions)),
+        'overlays are not exported'         : (overlay, 'raised'),
+    }
+
+
+# ================================
+def check_resolve():
+    intentions = pyretree.RegexCollection()
+    calls = []
+    release = threading.Event()
+
+    @intentions.add('play <song>')
+    def play(song, source=None):
+        calls.append(song)
+        return (song, source, threading.current_thread() is threading.main_thread())
+
+    @intentions.add('wait')
+    def wait():
+        release.wait(5)
+
+    intentions.prepare()
+
+    resolved = intentions.resolve('play cats', {'source': 'tests', 'unused': True})
+    not_called = list(calls)
+
+    with pyretree.Dispatcher(intentions, max_workers=1, max_pending=1) as dispatcher:
+        dispatched = dispatcher.dispatch('play dogs').result(5)
+        no_match = dispatcher.dispatch('jump')
+
+        blocking = dispatcher.dispatch('wait')
+        try:
+            dispatcher.dispatch('play birds', timeout=0.05)
+            busy = 'accepted'
+        except Exception:
+            busy = 'raised'
+
+        release.set()
+        blocking.result(5)
+
+    return {
+        'resolve does not call'             : ((resolved.expression, not_called), ('play <song>', [])),
+        'only accepted parameters'          : (resolved.kwargs, {'song': 'cats', 'source': 'tests'}),
+        'calling runs the callback'         : (resolved(), ('cats', 'tests', True)),
+        'nothing to resolve'                : (intentions.resolve('jump'), None),
+        'dispatched off the calling thread' : (dispatched, ('dogs', None, False)),
+        'dispatch without a match'          : (no_match, None),
+        'busy pool times out'               : (busy, 'raised'),
+    }
+
+
+# ================================
+def check_match_all():
+    intentions = build(['play <song>', 'play <song> on spotify', '<request> on spotify', 'play video <video>',
+                        'order <number:int>', 'order <name>'])
+
+    interpretations = list(intentions.match_all('play video cats on spotify'))
+
+    return {
+        'every interpretation, best first'  : ([found.expression for found in interpretations],
+                                               ['play <song> on spotify', '<request> on spotify', 'play video <video>', 'play <song>']),
+        'first is what match() calls'       : ((interpretations[0].expression, interpretations[0].kwargs),
+                                               intentions.match('play video cats on spotify')[1]),
+        'converted values'                  : ([found.kwargs for found in intentions.match_all('order 12')],
+                                               [{'number': 12}, {'name': '12'}]),
+        'not fitting the type'              : ([found.expression for found in intentions.match_all('order pizza')], ['order <name>']),
+        'nothing matches'                   : (list(intentions.match_all('jump')), []),
+    }
+
+
+# ================================
+def check_replay():
+    recorded = build(['play <song>', 'stop'])
+    texts = ['play cats', 'jump', 'play "tab\there"', 'stop']
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'queries.log')
+
+        recorded.record(path)
+        for text in texts:
+            recorded.match(text)
+        recorded.stop_recording()
+
+        # Not recorded once stopped, nor when sampled out
+        recorded.match('stop')
+        recorded.record(path, sample_rate=0)
+        recorded.match('stop')
+        recorded.stop_recording()
+
+        log = replay.read_log(path)
+        same = replay.replay(recorded, path, loops=2)
+        changed = replay.replay(build(['play <song>']), path, callbacks=True)
+
+    return {
+        'texts and outcomes'                : (log, [('play cats', True), ('jump', False), ('play "tab\there"', True), ('stop', True)]),
+        'replayed loops'                    : ((same['queries'], same['matched'], same['mismatched']), (8, 6, 0)),
+        'outcome changed since recording'   : ((changed['matched'], changed['mismatched']), (2, 1)),
+        'latency percentiles'               : (same['p50'] <= same['p99'] <= same['max'], True),
+    }
+
+
+# ================================
+_RELOADED_INTENTS = '''
+from pyretree import pyretree
+
+intentions = pyretree.RegexCollection()
+
+@intentions.add('play <song>')
+def play(song):
+    return {play}
+
+@intentions.add('{expression}')
+def other():
+    return 'other'
+
+intentions.prepare()
+'''
+
+
+def check_reload():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'reloaded_intents.py')
+
+        def write(play, expression):
+            with open(path, 'w') as file:
+                file.write(_RELOADED_INTENTS.format(play=play, expression=expression))
+
+        write('song', 'stop')
+        sys.path.insert(0, directory)
+        dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, True
+
+        try:
+            module = importlib.import_module('reloaded_intents')
+            reloader = pyretree.IntentReloader(module)
+            live = reloader.collection
+
+            write('song.upper()', 'pause')
+            diff = reloader.reload()
+
+            matches = [live.match(text) for text in ('play cats', 'pause', 'stop')]
+
+            write('song.upper(', 'pause')
+            try:
+                reloader.reload()
+                broken = 'reloaded'
+            except SyntaxError:
+                broken = 'raised'
+
+        finally:
+            sys.dont_write_bytecode = dont_write_bytecode
+            sys.path.remove(directory)
+            sys.modules.pop('reloaded_intents', None)
+
+    return {
+        'difference'                        : ({name: sorted(keys) for name, keys in diff.items()},
+                                               {'added': [('pause', 'other')], 'removed': [('stop', 'other')],
+                                                'changed': [('play <song>', 'play')]}),
+        'applied to the live collection'    : (matches, [(True, 'CATS'), (True, 'other'), (False, False)]),
+        'same collection object'            : (module.intentions is live, True),
+        'failed import keeps the intents'   : ((broken, live.match('play dogs')), ('raised', (True, 'DOGS'))),
+    }
+
+
+# ================================
+def check_memory_report():
+    expressions = [f'play <song> {number}' for number in range(20)] + ['stop', 'open <app>', 'open <file> with <app>']
+
+    report = build(expressions).memory_report(top=2)
+    preserved = build(expressions, preserve_regexps=True).memory_report()
+
+    try:
+        pyretree.RegexCollection().memory_report()
+        unprepared = 'reported'
+    except Exception:
+        unprepared = 'raised'
+
+    return {
+        'total of the categories'           : (report['total'], sum(report['categories'].values())),
+        'largest branch first'              : ([key for key, _ in report['branches']], ['play', 'open', 'stop']),
+        'largest buckets'                   : ([(path, count) for path, count, _ in report['largest_buckets']],
+                                               [('play', 20), ('open', 2)]),
+        'preserved regexps are counted'     : (preserved['categories']['raw_regexps'] > report['categories']['raw_regexps'], True),
+        'unprepared collection'             : (unprepared, 'raised'),
+    }
+
+
+# ================================
+def check_pattern_cache():
+    def pattern_of(intentions):
+        return next(iter(intentions._regex_tree._entries()))[1]
+
+    first = build(['play <song> loudly'])
+    second = pyretree.RegexCollection()
+
+    @second.add('play <song> loudly')
+    def loudly(song):
+        return song.upper()
+
+    second.prepare()
+    shared = pattern_of(first) is pattern_of(second)
+
+    # Kept alive by the most recently used patterns once no collection uses it; the re module's own cache of
+    # compiled patterns is purged so it does not keep them alive instead
+    kept = weakref.ref(pattern_of(build(['stop <device> now'])))
+    re.purge()
+    gc.collect()
+    kept_alive = kept() is not None
+
+    try:
+        pyretree.set_pattern_cache_size(0)
+        dropped = weakref.ref(pattern_of(build(['start <device> now'])))
+        re.purge()
+        gc.collect()
+        dropped_alive = dropped() is not None
+
+    finally:
+        pyretree.set_pattern_cache_size(4096)
+
+    return {
+        'shared between collections'        : (shared, True),
+        'callbacks stay separate'           : ((first.match('play cats loudly'), second.match('play cats loudly')),
+                                               ((True, ('play <song> loudly', {'song': 'cats'})), (True, 'CATS'))),
+        'recent patterns kept alive'        : (kept_alive, True),
+        'unused patterns freed at size 0'   : (dropped_alive, False),
+    }
+
+
+# ================================
+def check_merge():
+    def named(name):
+        return lambda **params: name
+
+    core = pyretree.RegexCollection()
+    for expression in ('play <song>', 'stop', '<request> on spotify'):
+        core.add(expression)(named('core'))
+    core.prepare()
+
+    plugin = pyretree.RegexCollection()
+    for expression in ('play video <video>', 'stop', '<request> on winamp'):
+        plugin.add(expression)(named('plugin'))
+    plugin.prepare()
+
+    outcomes = {}
+    for on_conflict in ('keep', 'replace', 'both'):
+        merged = build([])
+        merged.merge(core)
+        merged.merge(plugin, on_conflict=on_conflict)
+        outcomes[on_conflict] = [found.callback() for found in merged.match_all('stop')]
+
+    try:
+        core.merge(plugin)
+        conflict = 'merged'
+    except Exception:
+        conflict = 'raised'
+
+    merged = build(['open <app>'], preserve_regexps=True)
+    merged.merge(core)
+    merged.merge(plugin, on_conflict='keep')
+
+    # Later changes to the merged collection do not reach the ones merged into it
+    merged.add('play <song> now')(named('added'))
+    merged.prepare()
+
+    try:
+        merged.merge(build([], tokenizer=pyretree.Tokenizer(casefold=True)))
+        tokenizer = 'merged'
+    except Exception:
+        tokenizer = 'raised'
+
+    return {
+        'both sides match'                  : ([merged.match(text) for text in ('open slack', 'play video cats', 'x on spotify', 'x on winamp')],
+                                               [(True, ('open <app>', {'app': 'slack'})), (True, 'plugin'), (True, 'core'), (True, 'plugin')]),
+        'conflicting callbacks'             : (outcomes, {'keep': ['core'], 'replace': ['plugin'], 'both': ['core', 'plugin']}),
+        'conflict raises by default'        : (conflict, 'raised'),
+        'added after merging'               : (merged.match('play cats now'), (True, 'added')),
+        'merged-in collections unchanged'   : ((core.match('play cats now'), plugin.match('play cats'), len(plugin)),
+                                               ((True, 'core'), (False, False), 3)),
+        'different tokenizers'              : (tokenizer, 'raised'),
+    }
+
+
+# ================================
+feature_checks = {
+    'analyze'       : check_analyze,
+    'suffix index'  : check_suffix_index,
+    'max_depth'     : check_max_depth,
+    'overlay'       : check_overlay,
+    'complete'      : check_complete,
+    'stream'        : check_stream,
+    'fuzzy'         : check_fuzzy,
+    'sharded'       : check_sharded,
+    'SharedIndex'   : check_shared_index,
+    'resolve'       : check_resolve,
+    'match_all'     : check_match_all,
+    'replay'        : check_replay,
+    'reload'        : check_reload,
+    'memory_report' : check_memory_report,
+    'pattern cache' : check_pattern_cache,
+    'merge'         : check_merge,
+}
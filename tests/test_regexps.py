@@ -55,6 +55,37 @@ def add_intentions(intentions):
     def light():
         return "Turning on the light"
 
+
+    @intentions.add("<request> on spotify")
+    def spotify(request):
+        return f"Asking Spotify to {request}"
+
+
+    @intentions.add("order <number:int>")
+    def order_number(number):
+        return f"Ordering item #{number:03d}"
+
+    @intentions.add("order <name>")
+    def order_name(name):
+        return f'Ordering "{name.title()}"'
+
+    @intentions.add("wake me at <when:time>")
+    def wake_up(when):
+        return f"Waking you at {when.strftime('%H:%M')}"
+
+    @intentions.add("<minutes:int> more minutes")
+    def snooze(minutes):
+        return f"Snoozing for {minutes} minutes"
+
+    @intentions.add("<item:word> please")
+    def fetch(item):
+        return f'Fetching "{item}"'
+
+
+    @intentions.add("who is asking")
+    def who_is_asking(source):
+        return f"Asked from {source}"
+
         
 # ==============================================
 
@@ -96,8 +127,17 @@ def generate_random_intentions(func_count, dec_count=8):
         print(istress_out, file=intents_file)
 
         
-def get_intentions():
-    intentions = pyretree.RegexCollection()
+def get_intentions(max_depth=1):
+    intentions = pyretree.RegexCollection(max_depth=max_depth)
+    add_intentions(intentions)
+
+    intentions.prepare()
+    
+    return intentions
+
+
+def get_tokenized_intentions():
+    intentions = pyretree.RegexCollection(tokenizer=pyretree.Tokenizer(collapse=True, casefold=True))
     add_intentions(intentions)
 
     intentions.prepare()
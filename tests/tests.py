@@ -7,6 +7,7 @@ import pprint
 from test_helpers import format_seconds
 
 import test_regexps
+import test_features
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -65,11 +66,50 @@ tests = {
     # [5 consts] <var>
     'turn on the light at 3:00'                    : 'The light will turn on at 3:00',
     
+    # ----
+    # Leading variable, found through the suffix index
+    # <var> const const
+    'shuffle my likes on spotify'                  : 'Asking Spotify to shuffle my likes',
+    
+    # Suffix index and prefix candidates are checked by weight; the longer expression wins over "play <song>"
+    'play nightswimming on spotify'                : 'Asking Spotify to play nightswimming',
+    
+    # --
+    # Typed variables are converted before the call; a value not fitting the type tries the next expression
+    'order 12'                                     : 'Ordering item #012',
+    'order pizza'                                  : 'Ordering "Pizza"',
+    'wake me at 7:30'                              : 'Waking you at 07:30',
+    
+    # Fits the time pattern but is not a time; no match
+    'wake me at 25:00'                             : False,
+    
+    # A word fitting several typed edges follows each of them, narrowest first
+    '5 more minutes'                               : 'Snoozing for 5 minutes',
+    '12 please'                                    : 'Fetching "12"',
+    
+    # --
+    # Callbacks only receive the extra parameters they accept
+    'who is asking'                                : 'Asked from tests',
+    
+}
+
+# Passed to every match; callbacks not accepting them must still be called
+extra_params = {'source': 'tests'}
+
+# Matched against test_regexps.get_tokenized_intentions()
+tokenizer_tests = {
+    # Letter case and repeated whitespace do not change the tree lookup
+    'Play  Nightswimming'                          : 'Playing "Nightswimming"',
+    'PLAY video Cats'                              : 'Asking Youtube to play "Cats"',
+    'Turn On  the light'                           : 'Turning on the light',
+    'open   Slack'                                 : 'Opening Slack',
+    
 }
 
 
 # ================================
-def run_tests(intentions, show_results=True, profile=False):
+def run_tests(intentions, show_results=True, profile=False, cases=None):
+    cases = tests if cases is None else cases
     passed = 0
     failed = 0
     times = []
@@ -78,14 +118,15 @@ def run_tests(intentions, show_results=True, profile=False):
         profiler = cProfile.Profile(timer=time.process_time)
         profiler.enable() 
     
-    for i, (test, expected) in enumerate(tests.items()):
+    for i, (test, expected) in enumerate(cases.items()):
         start = time.perf_counter()
-        result, match = intentions.match(test)
+        result, match = intentions.match(test, extra_params)
         
         end = time.perf_counter()
         times.append(end-start)
         
-        success = result and (match == expected)
+        # An expected result of False means the text must not match
+        success = (not result) if expected is False else (result and (match == expected))
         
         if success:
             passed += 1
@@ -94,7 +135,7 @@ def run_tests(intentions, show_results=True, profile=False):
         
         if show_results:
             pad_before = " " * max(0, (50 - len(test)))
-            pad_after = " " * max(0, (60 - len(match)))
+            pad_after = " " * max(0, (60 - len(str(match))))
             if not success: print('--')
             print(f'{i:<4}: {test} {pad_before} => {match} {pad_after} || {"Passed" if success else "Failed **"}')
             if not success: print('--')
@@ -109,11 +150,41 @@ def run_tests(intentions, show_results=True, profile=False):
         print(s.getvalue())
      
     if show_results:
-        print(f'\n{len(tests)}/{passed} passed, {failed} failed')
+        print(f'\n{len(cases)}/{passed} passed, {failed} failed')
 
     return times
 
     
+# ================================
+def run_feature_tests(show_results=True):
+    passed = 0
+    failed = 0
+    
+    for feature, check in test_features.feature_checks.items():
+        if show_results:
+            print(f'\n({feature})')
+        
+        for i, (test, (result, expected)) in enumerate(check().items()):
+            success = result == expected
+            
+            if success:
+                passed += 1
+            else:
+                failed += 1
+            
+            if show_results:
+                pad_before = " " * max(0, (50 - len(test)))
+                pad_after = " " * max(0, (60 - len(str(result))))
+                if not success: print('--')
+                print(f'{i:<4}: {test} {pad_before} => {result} {pad_after} || {"Passed" if success else f"Failed ** (expected {expected})"}')
+                if not success: print('--')
+    
+    if show_results:
+        print(f'\n{passed + failed}/{passed} passed, {failed} failed')
+    
+    return failed
+
+
 # ================================
 def get_runtime(intentions, loops):
     print(f'\nRunning time test ({len(intentions)} intents, {len(tests)} queries, {loops} iterations)...')
@@ -149,12 +220,13 @@ if __name__ == '__main__':
     args = sys.argv
     
     if len(args) == 1:
-        print('Valid arguments are [--base, --base-profile], --runtime, [--stress, --stress-profile]')
+        print('Valid arguments are [--base, --base-profile], --features, --runtime, [--stress, --stress-profile]')
         sys.exit()
     
     flags = {
         'base':           '--base' in args,
         'base-profile':   '--base-profile' in args,
+        'features':       '--features' in args,
         'runtime':        '--runtime' in args,
         'stress':         '--stress' in args,
         'stress-profile': '--stress-profile' in args
@@ -170,6 +242,18 @@ if __name__ == '__main__':
     print()
     if flags['base'] or flags['base-profile']:
         run_tests(intentions, profile=flags['base-profile'])
+        
+        print('\n(Tokenizer)')
+        run_tests(test_regexps.get_tokenized_intentions(), profile=flags['base-profile'], cases=tokenizer_tests)
+        
+        # Deeper trees narrow the candidates further but must match the same
+        for max_depth in (2, 3):
+            print(f'\n(max_depth={max_depth})')
+            run_tests(test_regexps.get_intentions(max_depth=max_depth), profile=flags['base-profile'])
+
+    if flags['features']:
+        print(sep)
+        run_feature_tests()
 
     if flags['runtime']:
         print(sep)